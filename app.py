@@ -20,6 +20,7 @@ st.set_page_config(page_title="Foresight Pricing", layout="wide")
 # Splash ONCE per session (show_boot_splash handles timing + rerun internally)
 show_boot_splash(video_path="assets/boot.mp4", seconds=4.8)
 
+# Schema migrations run once per process; later reruns return immediately.
 init_db()
 
 if not require_login():
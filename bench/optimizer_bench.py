@@ -0,0 +1,278 @@
+"""
+Synthetic benchmark for optimise_basket.
+
+Generates seeded supplier price frames, baskets and small-lot tier tables,
+sweeps supplier count, basket lines, price density and tier count, and
+reports latency percentiles, search nodes, supplier sets evaluated and peak
+memory per case. Results go to a JSON artefact; pass --compare with an
+earlier artefact to flag cases that got slower.
+
+By default every search runs to completion. With --time-limit or
+--node-limit, cases where any run hit the budget are listed separately as
+capped: their latencies and counts measure the budget, not the search, so
+--compare skips them.
+
+Run from the repo root:
+    python -m bench.optimizer_bench --out bench_output.json
+    python -m bench.optimizer_bench --quick --compare bench_output.json
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from src.optimizer import optimise_basket, TierSchedule
+
+SUPPLIERS = [5, 10, 20, 30]
+LINES = [5, 10, 20]
+DENSITIES = [0.3, 0.6, 0.9]
+TIER_COUNTS = [3, 6]
+
+QUICK_SUPPLIERS = [5, 10, 20]
+QUICK_LINES = [5, 10]
+QUICK_DENSITIES = [0.6]
+QUICK_TIER_COUNTS = [6]
+
+QTY_CHOICES = [1, 2, 3, 5, 8, 12, 20, 30]
+
+
+def make_tiers(n_tiers: int, seed: int | str) -> pd.DataFrame:
+    """
+    n_tiers contiguous bands from 0.6 t upwards with decreasing £/t charges;
+    the last band is open-ended and free, like the production table.
+    """
+    rng = random.Random(seed)
+    edges = [0.6]
+    for _ in range(n_tiers - 1):
+        edges.append(round(edges[-1] * rng.uniform(1.8, 3.0), 1))
+
+    rows = []
+    charge = rng.uniform(100.0, 160.0)
+    for i, mn in enumerate(edges):
+        last = i == len(edges) - 1
+        rows.append({
+            "tier_id": i + 1,
+            "min_t": mn,
+            "max_t": None if last else round(edges[i + 1] - 0.1, 1),
+            "charge_per_t": 0.0 if last else round(charge, 1),
+            "active": 1,
+        })
+        charge *= rng.uniform(0.3, 0.6)
+    return pd.DataFrame(rows)
+
+
+def make_instance(n_suppliers: int, n_lines: int, density: float, seed: int | str) -> tuple[pd.DataFrame, list[dict]]:
+    """
+    Supplier price frame and basket. Each supplier quotes each basket line
+    with probability `density`; every line gets at least one quote.
+    """
+    rng = random.Random(seed)
+    suppliers = [f"SUP{j:03d}" for j in range(n_suppliers)]
+    rows = []
+    basket = []
+    for i in range(n_lines):
+        product = f"PROD{i:03d}"
+        location = f"LOC{rng.randrange(4)}"
+        window = f"W{rng.randrange(3)}"
+        ref = rng.uniform(180.0, 420.0)
+
+        quoting = [s for s in suppliers if rng.random() < density] or [rng.choice(suppliers)]
+        for s in quoting:
+            rows.append({
+                "Supplier": s,
+                "Product": product,
+                "Location": location,
+                "Delivery Window": window,
+                "Price": round(ref * rng.uniform(0.9, 1.1), 0),
+            })
+
+        basket.append({
+            "Product": product,
+            "Location": location,
+            "Delivery Window": window,
+            "Qty": float(rng.choice(QTY_CHOICES)),
+        })
+    return pd.DataFrame(rows), basket
+
+
+def run_case(n_suppliers: int, n_lines: int, density: float, n_tiers: int, args) -> dict:
+    latencies = []
+    nodes = []
+    evaluated = []
+    complete = 0
+    peak = 0
+
+    for rep in range(args.repeats):
+        seed = f"{args.seed}:{n_suppliers}:{n_lines}:{density}:{n_tiers}:{rep}"
+        prices, basket = make_instance(n_suppliers, n_lines, density, seed)
+        tiers = TierSchedule.from_frame(make_tiers(n_tiers, seed))
+
+        t0 = time.perf_counter()
+        res = optimise_basket(
+            prices, basket, tiers, time_limit=args.time_limit, node_limit=args.node_limit, stats=True
+        )
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+
+        # Memory is measured on a separate run: tracing slows allocation down
+        # enough to distort the latencies.
+        if rep == 0:
+            tracemalloc.start()
+            optimise_basket(prices, basket, tiers, time_limit=args.time_limit, node_limit=args.node_limit)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        if not res.get("ok"):
+            raise RuntimeError(f"optimise_basket failed: {res.get('error')}")
+        nodes.append(res["nodes"])
+        evaluated.append(res["stats"]["evaluated"])
+        complete += bool(res["complete"])
+
+    lat = np.array(latencies)
+    return {
+        "suppliers": n_suppliers,
+        "lines": n_lines,
+        "density": density,
+        "tiers": n_tiers,
+        "runs": args.repeats,
+        "latency_ms": {
+            "p50": float(np.percentile(lat, 50)),
+            "p90": float(np.percentile(lat, 90)),
+            "p99": float(np.percentile(lat, 99)),
+            "max": float(lat.max()),
+            "mean": float(lat.mean()),
+        },
+        "nodes": {
+            "mean": float(np.mean(nodes)),
+            "max": int(np.max(nodes)),
+        },
+        "evaluated": {
+            "mean": float(np.mean(evaluated)),
+            "max": int(np.max(evaluated)),
+        },
+        "complete_rate": complete / args.repeats,
+        "capped": complete < args.repeats,
+        "peak_mem_kb": peak / 1024.0,
+    }
+
+
+def _case_id(case: dict) -> str:
+    return f"k={case['suppliers']} n={case['lines']} d={case['density']} t={case['tiers']}"
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_ms: float = 5.0) -> list[str]:
+    """
+    Cases whose p50 latency or mean nodes grew by more than `threshold`
+    (a ratio, e.g. 1.25) against the baseline artefact. Latency changes under
+    min_ms are treated as noise; capped cases on either side are skipped.
+    """
+    base = {_case_id(c): c for c in baseline.get("cases", [])}
+    regressions = []
+    for case in current["cases"]:
+        old = base.get(_case_id(case))
+        if old is None or case.get("capped") or old.get("capped"):
+            continue
+        for label, new_v, old_v in [
+            ("p50 ms", case["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            ("nodes", case["nodes"]["mean"], old["nodes"]["mean"]),
+        ]:
+            if label == "p50 ms" and new_v - old_v < min_ms:
+                continue
+            if old_v > 0 and new_v / old_v > threshold:
+                regressions.append(f"{_case_id(case)}: {label} {old_v:.1f} -> {new_v:.1f} ({new_v / old_v:.2f}x)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--quick", action="store_true", help="small grid for a fast smoke run")
+    ap.add_argument("--repeats", type=int, default=5, help="instances per case")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--time-limit", type=float, default=None, help="optimise_basket time_limit (s)")
+    ap.add_argument("--node-limit", type=int, default=None, help="optimise_basket node_limit")
+    ap.add_argument("--out", default="bench_output.json", help="JSON artefact to write")
+    ap.add_argument("--compare", default=None, help="earlier artefact to compare against")
+    ap.add_argument("--threshold", type=float, default=1.25, help="regression ratio for --compare")
+    args = ap.parse_args(argv)
+
+    if args.quick:
+        grid = itertools.product(QUICK_SUPPLIERS, QUICK_LINES, QUICK_DENSITIES, QUICK_TIER_COUNTS)
+    else:
+        grid = itertools.product(SUPPLIERS, LINES, DENSITIES, TIER_COUNTS)
+
+    cases = []
+    print(
+        f"{'case':<28}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'nodes':>10}{'evaluated':>11}"
+        f"{'done':>7}{'peak KB':>10}"
+    )
+    for k, n, d, t in grid:
+        case = run_case(k, n, d, t, args)
+        cases.append(case)
+        lat = case["latency_ms"]
+        print(
+            f"{_case_id(case):<28}{lat['p50']:>10.1f}{lat['p90']:>10.1f}{lat['p99']:>10.1f}"
+            f"{case['nodes']['mean']:>10.0f}{case['evaluated']['mean']:>11.0f}"
+            f"{case['complete_rate']:>7.0%}{case['peak_mem_kb']:>10.0f}"
+        )
+
+    capped = [case for case in cases if case["capped"]]
+    if capped:
+        print(f"\nCapped by the search budget ({len(capped)} cases, not comparable):")
+        for case in capped:
+            print(f"  {_case_id(case)}: {case['complete_rate']:.0%} of runs finished")
+
+    artefact = {
+        "created_utc": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "settings": {
+            "repeats": args.repeats,
+            "seed": args.seed,
+            "time_limit": args.time_limit,
+            "node_limit": args.node_limit,
+            "quick": args.quick,
+        },
+        "cases": cases,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(artefact, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if baseline is not None:
+        regressions = compare(artefact, baseline, args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print("No regressions against", args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
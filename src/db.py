@@ -1,5 +1,7 @@
 import sqlite3
+import threading
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 import hashlib
 import uuid
@@ -7,22 +9,131 @@ import json
 
 DB_PATH = "foresight.db"
 
+# Open connections kept by the pool (in use + idle). A thread that needs one
+# while all are in use waits for one to be returned.
+POOL_SIZE = 8
+# Prepared statements cached per connection by sqlite3.
+STATEMENT_CACHE = 256
 
-def conn():
-    c = sqlite3.connect(DB_PATH, check_same_thread=False)
+
+def _connect(path):
+    c = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE)
     c.execute("PRAGMA journal_mode=WAL;")
     c.execute("PRAGMA foreign_keys=ON;")
     return c
 
 
+def _healthy(c) -> bool:
+    try:
+        c.execute("SELECT 1").fetchone()
+    except sqlite3.Error:
+        return False
+    return not c.in_transaction
+
+
+class _Pooled:
+    """A pooled connection plus the data_versions() it last read (see there)."""
+
+    __slots__ = ("path", "conn", "mark", "versions")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = _connect(path)
+        self.mark = None
+        self.versions: dict[str, int] = {}
+
+
+class _ConnectionPool:
+    """
+    Persistent connections to DB_PATH, opened (and their pragmas set) once.
+
+    A thread holds one connection for the length of a transaction() block and
+    nested blocks on that thread reuse it; afterwards it goes back to the idle
+    list for the next caller. Connections are health-checked on checkout and
+    reopened if broken or if DB_PATH has changed.
+    """
+
+    def __init__(self, max_size: int):
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: list[_Pooled] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _checkout(self) -> _Pooled:
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return _Pooled(DB_PATH)
+                if item.path == DB_PATH and _healthy(item.conn):
+                    return item
+                item.conn.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, item):
+        with self._lock:
+            self._idle.append(item)
+        self._slots.release()
+
+    def held(self) -> _Pooled | None:
+        """The pooled connection this thread is inside a transaction with."""
+        return getattr(self._local, "held", None)
+
+    @contextmanager
+    def transaction(self):
+        held = self.held()
+        if held is not None:
+            yield held.conn
+            return
+
+        held = self._checkout()
+        self._local.held = held
+        c = held.conn
+        try:
+            yield c
+            c.commit()
+        except BaseException:
+            c.rollback()
+            raise
+        finally:
+            self._local.held = None
+            self._checkin(held)
+
+    def close(self):
+        """Close idle connections (e.g. at shutdown or in tests)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for item in idle:
+            item.conn.close()
+
+
+_POOL = _ConnectionPool(POOL_SIZE)
+
+
+def transaction():
+    """
+    Context manager giving a pooled connection for one unit of work:
+    commits when the block exits normally, rolls back if it raises.
+    Nested calls on the same thread join the outer transaction.
+    """
+    return _POOL.transaction()
+
+
 def utc_now_iso():
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
-def init_db():
-    c = conn()
-    cur = c.cursor()
+# ---------------- Schema ----------------
+# Ordered migrations. Each one brings the schema from the previous version to
+# its own and is written to be safe on databases created before schema_version
+# existed (IF NOT EXISTS, column checks), which start from version 0.
 
+def _migrate_001_initial(cur):
+    """Base schema: snapshots, margins, presence, settings, tiers, orders."""
     # --- Supplier snapshots ---
     cur.execute("""
     CREATE TABLE IF NOT EXISTS supplier_snapshots (
@@ -211,8 +322,136 @@ def init_db():
     except Exception:
         pass
 
-    c.commit()
-    c.close()
+
+def _migrate_002_sell_prices(cur):
+    """Materialised sell prices and the indexes used to re-price them."""
+    # sell_price = price + effective margin, kept current by _reprice.
+    for table in PRICE_TABLES:
+        if not _has_column(cur, table, "sell_price"):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN sell_price REAL;")
+            _reprice(cur, table)
+
+    # Scoped re-pricing after a margin change (see _reprice)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_supplier_prices_product ON supplier_prices (product);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_supplier_prices_category ON supplier_prices (product_category);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_seed_prices_product ON seed_prices (product);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_seed_prices_category ON seed_prices (product_category);")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_margins_scope
+    ON price_margins (scope_type, scope_value, active, margin_id);
+    """)
+
+
+def _migrate_003_best_prices(cur):
+    """Precomputed best-price boards."""
+    # One board per snapshot, tagged with the margin version it was built under.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS best_prices (
+        snapshot_id TEXT NOT NULL,
+        margin_version INTEGER NOT NULL,
+        product_category TEXT NOT NULL,
+        product TEXT NOT NULL,
+        location TEXT NOT NULL,
+        delivery_window TEXT NOT NULL,
+        best_price REAL NOT NULL,
+        unit TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        PRIMARY KEY (snapshot_id, margin_version, product_category, product, location, delivery_window)
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_best_prices_product ON best_prices (snapshot_id, margin_version, product);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_best_prices_location ON best_prices (snapshot_id, margin_version, location);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_best_prices_window ON best_prices (snapshot_id, margin_version, delivery_window);")
+
+
+def _migrate_004_data_versions(cur):
+    """Per-domain change counters (the margin counter moves out of app_settings)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS data_versions (
+        domain TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    cur.executemany("INSERT OR IGNORE INTO data_versions (domain, version) VALUES (?, 0)", [(d,) for d in DOMAINS])
+    # The margin counter used to live in app_settings
+    cur.execute("SELECT value FROM app_settings WHERE key = 'margin_version'")
+    row = cur.fetchone()
+    if row:
+        cur.execute("UPDATE data_versions SET version = ? WHERE domain = 'margins'", (int(row[0]),))
+        cur.execute("DELETE FROM app_settings WHERE key = 'margin_version'")
+
+
+MIGRATIONS = [
+    (1, _migrate_001_initial),
+    (2, _migrate_002_sell_prices),
+    (3, _migrate_003_best_prices),
+    (4, _migrate_004_data_versions),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_SCHEMA_LOCK = threading.Lock()
+# DB paths this process has already brought up to date.
+_SCHEMA_READY: set[str] = set()
+
+
+def _has_column(cur, table, column) -> bool:
+    cur.execute(f"PRAGMA table_info({table})")
+    return any(r[1] == column for r in cur.fetchall())
+
+
+def _schema_version(cur) -> int:
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+    if not cur.fetchone():
+        return 0
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    return int(cur.fetchone()[0] or 0)
+
+
+def migrate():
+    """
+    Apply pending migrations in order. Reads the schema version first and
+    writes nothing when it is current; otherwise takes the write lock
+    (BEGIN IMMEDIATE, so concurrent processes queue up), re-checks, and
+    applies and records each pending migration in one transaction.
+    """
+    with transaction() as c:
+        cur = c.cursor()
+        if _schema_version(cur) >= SCHEMA_VERSION:
+            return
+
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at_utc TEXT NOT NULL
+        );
+        """)
+        current = _schema_version(cur)
+        for version, step in MIGRATIONS:
+            if version > current:
+                step(cur)
+                cur.execute(
+                    "INSERT INTO schema_version (version, name, applied_at_utc) VALUES (?, ?, ?)",
+                    (version, step.__name__, utc_now_iso())
+                )
+
+
+def init_db():
+    """
+    Make sure the schema is current. The check runs once per process (per
+    DB_PATH) behind a lock; every later call, e.g. on each Streamlit rerun,
+    returns immediately.
+    """
+    if DB_PATH in _SCHEMA_READY:
+        return
+    with _SCHEMA_LOCK:
+        if DB_PATH in _SCHEMA_READY:
+            return
+        migrate()
+        _SCHEMA_READY.add(DB_PATH)
 
 
 def _set_default(cur, key, value):
@@ -221,70 +460,167 @@ def _set_default(cur, key, value):
         cur.execute("INSERT INTO app_settings (key, value) VALUES (?, ?)", (key, value))
 
 
+# ---------------- Change detection ----------------
+# Every write bumps its domain's counter in data_versions, in the same
+# transaction as the change, so any process can tell what changed.
+
+DOMAINS = ("snapshots", "margins", "tiers", "settings", "orders")
+
+
+def _bump_version(cur, domain) -> int:
+    """Increment a domain's version counter and return the new value."""
+    cur.execute("""
+        INSERT INTO data_versions (domain, version) VALUES (?, 1)
+        ON CONFLICT(domain) DO UPDATE SET version = version + 1
+    """, (domain,))
+    return _get_version(cur, domain)
+
+
+def _get_version(cur, domain) -> int:
+    cur.execute("SELECT version FROM data_versions WHERE domain = ?", (domain,))
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def data_versions() -> dict[str, int]:
+    """
+    Current version of every domain. PRAGMA data_version only moves when
+    another connection commits, and total_changes when this one writes; if
+    neither has moved since this connection last read the counters, the
+    cached ones are returned without touching data_versions.
+    """
+    with transaction() as c:
+        held = _POOL.held()
+        mark = (c.execute("PRAGMA data_version").fetchone()[0], c.total_changes)
+        if held.mark != mark:
+            held.versions = dict(c.execute("SELECT domain, version FROM data_versions").fetchall())
+            held.mark = mark
+        return dict(held.versions)
+
+
+_MEMO: dict = {}
+_MEMO_LOCK = threading.Lock()
+
+
+def _memoised(domain, name, load):
+    """load() cached until the domain's version changes."""
+    key = (DB_PATH, data_versions().get(domain, 0))
+    with _MEMO_LOCK:
+        hit = _MEMO.get(name)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    value = load()
+    with _MEMO_LOCK:
+        _MEMO[name] = (key, value)
+    return value
+
+
+PRICE_TABLES = ("supplier_prices", "seed_prices")
+
+# Same rules as pricing.apply_margins: the newest active margin per scope,
+# a product margin beats a category margin, no margin means +0.
+_REPRICE_SQL = """
+    UPDATE {table} SET sell_price = price + COALESCE(
+        (SELECT m.margin_per_t FROM price_margins m
+         WHERE m.scope_type = 'product' AND m.scope_value = {table}.product AND m.active = 1
+         ORDER BY m.margin_id DESC LIMIT 1),
+        (SELECT m.margin_per_t FROM price_margins m
+         WHERE m.scope_type = 'category' AND m.scope_value = {table}.product_category AND m.active = 1
+         ORDER BY m.margin_id DESC LIMIT 1),
+        0.0
+    )
+"""
+
+
+def _reprice(cur, table, snapshot_id=None, scope=None):
+    """
+    Recompute sell_price. snapshot_id limits it to one snapshot; scope
+    (scope_type, scope_value) limits it to the rows a margin on that scope
+    can affect. With neither, every row is recomputed.
+    """
+    where, params = [], []
+    if snapshot_id is not None:
+        where.append("snapshot_id = ?")
+        params.append(snapshot_id)
+    if scope is not None:
+        scope_type, scope_value = scope
+        where.append(("product" if scope_type == "product" else "product_category") + " = ?")
+        params.append(scope_value)
+
+    sql = _REPRICE_SQL.format(table=table)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    cur.execute(sql, params)
+
+
 # ---------------- Settings ----------------
 
 def get_settings() -> dict:
-    c = conn()
-    df = pd.read_sql_query("SELECT key, value FROM app_settings", c)
-    c.close()
+    return dict(_memoised("settings", "settings", _load_settings))
+
+
+def _load_settings() -> dict:
+    with transaction() as c:
+        df = pd.read_sql_query("SELECT key, value FROM app_settings", c)
     return {r["key"]: r["value"] for _, r in df.iterrows()}
 
 
 def set_setting(key: str, value: str):
-    c = conn()
-    cur = c.cursor()
-    cur.execute("""
-        INSERT INTO app_settings (key, value) VALUES (?, ?)
-        ON CONFLICT(key) DO UPDATE SET value = excluded.value
-    """, (key, value))
-    c.commit()
-    c.close()
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("""
+            INSERT INTO app_settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, value))
+        _bump_version(cur, "settings")
 
 
 # ---------------- Supplier snapshots ----------------
 
 def list_supplier_snapshots(limit=200) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query(f"""
-        SELECT snapshot_id, published_at_utc, published_by, row_count
-        FROM supplier_snapshots
-        ORDER BY published_at_utc DESC
-        LIMIT {int(limit)}
-    """, c)
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query(f"""
+            SELECT snapshot_id, published_at_utc, published_by, row_count
+            FROM supplier_snapshots
+            ORDER BY published_at_utc DESC
+            LIMIT {int(limit)}
+        """, c)
     return df
 
 
 def latest_supplier_snapshot():
-    c = conn()
-    cur = c.cursor()
-    cur.execute("""
-        SELECT snapshot_id, published_at_utc, published_by
-        FROM supplier_snapshots
-        ORDER BY published_at_utc DESC
-        LIMIT 1
-    """)
-    row = cur.fetchone()
-    c.close()
+    return _memoised("snapshots", "latest_supplier_snapshot", _load_latest_supplier_snapshot)
+
+
+def _load_latest_supplier_snapshot():
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("""
+            SELECT snapshot_id, published_at_utc, published_by
+            FROM supplier_snapshots
+            ORDER BY published_at_utc DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
     return row
 
 
 def load_supplier_prices(snapshot_id: str) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT
-          supplier AS "Supplier",
-          product_category AS "Product Category",
-          product AS "Product",
-          location AS "Location",
-          delivery_window AS "Delivery Window",
-          price AS "Price",
-          unit AS "Unit"
-        FROM supplier_prices
-        WHERE snapshot_id = ?
-        ORDER BY supplier, product, location, delivery_window
-    """, c, params=(snapshot_id,))
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT
+              supplier AS "Supplier",
+              product_category AS "Product Category",
+              product AS "Product",
+              location AS "Location",
+              delivery_window AS "Delivery Window",
+              price AS "Price",
+              unit AS "Unit",
+              sell_price AS "Sell Price"
+            FROM supplier_prices
+            WHERE snapshot_id = ?
+            ORDER BY supplier, product, location, delivery_window
+        """, c, params=(snapshot_id,))
     return df
 
 
@@ -302,131 +638,234 @@ def publish_supplier_snapshot(df: pd.DataFrame, published_by: str, source_bytes:
     source_hash = hashlib.sha256(source_bytes).hexdigest()
     row_count = int(len(work))
 
-    c = conn()
-    cur = c.cursor()
+    with transaction() as c:
+        cur = c.cursor()
 
-    cur.execute("""
-        INSERT INTO supplier_snapshots (snapshot_id, published_at_utc, published_by, source_hash, row_count)
-        VALUES (?, ?, ?, ?, ?)
-    """, (snapshot_id, published_at, published_by, source_hash, row_count))
+        cur.execute("""
+            INSERT INTO supplier_snapshots (snapshot_id, published_at_utc, published_by, source_hash, row_count)
+            VALUES (?, ?, ?, ?, ?)
+        """, (snapshot_id, published_at, published_by, source_hash, row_count))
 
-    rows = []
+        rows = []
         for r in work.to_dict("records"):
-        rows.append((
-            snapshot_id,
-            str(r["Supplier"]).strip(),
-            str(r.get("Product Category", "")).strip(),
-            str(r["Product"]).strip(),
-            str(r.get("Location", "")).strip(),
-            str(r["Delivery Window"]).strip(),
-            float(r["Price"]),
-            str(r["Unit"]).strip(),
-        ))
-
-    cur.executemany("""
-        INSERT OR IGNORE INTO supplier_prices
-        (snapshot_id, supplier, product_category, product, location, delivery_window, price, unit)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, rows)
-
-    c.commit()
-    c.close()
+            rows.append((
+                snapshot_id,
+                str(r["Supplier"]).strip(),
+                str(r.get("Product Category", "")).strip(),
+                str(r["Product"]).strip(),
+                str(r.get("Location", "")).strip(),
+                str(r["Delivery Window"]).strip(),
+                float(r["Price"]),
+                str(r["Unit"]).strip(),
+            ))
+
+        cur.executemany("""
+            INSERT OR IGNORE INTO supplier_prices
+            (snapshot_id, supplier, product_category, product, location, delivery_window, price, unit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        _reprice(cur, "supplier_prices", snapshot_id)
+        _build_best_prices(cur, "supplier_prices", snapshot_id, _get_version(cur, "margins"))
+        _bump_version(cur, "snapshots")
+
     return snapshot_id
 
 
 # ---------------- Seed snapshots (NEW) ----------------
 
 def list_seed_snapshots(limit=200) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query(f"""
-        SELECT snapshot_id, published_at_utc, published_by, row_count
-        FROM seed_snapshots
-        ORDER BY published_at_utc DESC
-        LIMIT {int(limit)}
-    """, c)
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query(f"""
+            SELECT snapshot_id, published_at_utc, published_by, row_count
+            FROM seed_snapshots
+            ORDER BY published_at_utc DESC
+            LIMIT {int(limit)}
+        """, c)
     return df
 
 
 def latest_seed_snapshot():
-    c = conn()
-    cur = c.cursor()
-    cur.execute("""
-        SELECT snapshot_id, published_at_utc, published_by
-        FROM seed_snapshots
-        ORDER BY published_at_utc DESC
-        LIMIT 1
-    """)
-    row = cur.fetchone()
-    c.close()
+    return _memoised("snapshots", "latest_seed_snapshot", _load_latest_seed_snapshot)
+
+
+def _load_latest_seed_snapshot():
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("""
+            SELECT snapshot_id, published_at_utc, published_by
+            FROM seed_snapshots
+            ORDER BY published_at_utc DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
     return row
 
 
 def load_seed_prices(snapshot_id: str) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT
-          supplier AS "Supplier",
-          product_category AS "Product Category",
-          product AS "Product",
-          location AS "Location",
-          delivery_window AS "Delivery Window",
-          price AS "Price",
-          unit AS "Unit"
-        FROM seed_prices
-        WHERE snapshot_id = ?
-        ORDER BY supplier, product, location, delivery_window
-    """, c, params=(snapshot_id,))
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT
+              supplier AS "Supplier",
+              product_category AS "Product Category",
+              product AS "Product",
+              location AS "Location",
+              delivery_window AS "Delivery Window",
+              price AS "Price",
+              unit AS "Unit",
+              sell_price AS "Sell Price"
+            FROM seed_prices
+            WHERE snapshot_id = ?
+            ORDER BY supplier, product, location, delivery_window
+        """, c, params=(snapshot_id,))
     return df
 
 def publish_seed_snapshot(df: pd.DataFrame, published_by: str, source_bytes: bytes) -> str:
+    # --- DB safety net: drop rows with missing/invalid Price ---
+    work = df.copy()
+    work["Price"] = pd.to_numeric(work["Price"], errors="coerce")
+    work = work.dropna(subset=["Price"])
+
+    if work.empty:
+        raise ValueError("No valid rows to publish (all rows had blank/invalid Price).")
+
     snapshot_id = str(uuid.uuid4())
     published_at = utc_now_iso()
     source_hash = hashlib.sha256(source_bytes).hexdigest()
-    row_count = int(len(df))
+    row_count = int(len(work))
 
-    c = conn()
-    cur = c.cursor()
+    with transaction() as c:
+        cur = c.cursor()
 
-    cur.execute("""
-        INSERT INTO seed_snapshots (snapshot_id, published_at_utc, published_by, source_hash, row_count)
-        VALUES (?, ?, ?, ?, ?)
-    """, (snapshot_id, published_at, published_by, source_hash, row_count))
+        cur.execute("""
+            INSERT INTO seed_snapshots (snapshot_id, published_at_utc, published_by, source_hash, row_count)
+            VALUES (?, ?, ?, ?, ?)
+        """, (snapshot_id, published_at, published_by, source_hash, row_count))
 
-    rows = []
+        rows = []
         for r in work.to_dict("records"):
-        rows.append((
-            snapshot_id,
-            str(r["Supplier"]).strip(),
-            str(r.get("Product Category", "")).strip(),
-            str(r["Product"]).strip(),
-            str(r.get("Location", "")).strip(),
-            str(r["Delivery Window"]).strip(),
-            float(r["Price"]),
-            str(r["Unit"]).strip(),
-        ))
-
-    cur.executemany("""
-        INSERT INTO seed_prices
-        (snapshot_id, supplier, product_category, product, location, delivery_window, price, unit)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, rows)
-
-    c.commit()
-    c.close()
+            rows.append((
+                snapshot_id,
+                str(r["Supplier"]).strip(),
+                str(r.get("Product Category", "")).strip(),
+                str(r["Product"]).strip(),
+                str(r.get("Location", "")).strip(),
+                str(r["Delivery Window"]).strip(),
+                float(r["Price"]),
+                str(r["Unit"]).strip(),
+            ))
+
+        cur.executemany("""
+            INSERT INTO seed_prices
+            (snapshot_id, supplier, product_category, product, location, delivery_window, price, unit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        _reprice(cur, "seed_prices", snapshot_id)
+        _build_best_prices(cur, "seed_prices", snapshot_id, _get_version(cur, "margins"))
+        _bump_version(cur, "snapshots")
+
     return snapshot_id
 
+# ---------------- Best-price boards ----------------
+# Lowest sell price per (category, product, location, window) of a snapshot,
+# built in SQL at publish time and after margin changes. Ties go to the
+# supplier first by name, as in the pandas board this replaces.
+
+SNAPSHOT_TABLES = {"supplier_prices": "supplier_snapshots", "seed_prices": "seed_snapshots"}
+
+_BOARD_FILTERS = {
+    "category": "product_category",
+    "product": "product",
+    "location": "location",
+    "window": "delivery_window",
+}
+
+
+def _build_best_prices(cur, table, snapshot_id, margin_version):
+    cur.execute("DELETE FROM best_prices WHERE snapshot_id = ?", (snapshot_id,))
+    cur.execute(f"""
+        INSERT INTO best_prices
+        (snapshot_id, margin_version, product_category, product, location, delivery_window, best_price, unit, supplier)
+        SELECT snapshot_id, ?, product_category, product, location, delivery_window, sell_price, unit, supplier
+        FROM (
+            SELECT
+              snapshot_id, COALESCE(product_category, '') AS product_category, product, location,
+              delivery_window, sell_price, unit, supplier,
+              ROW_NUMBER() OVER (
+                PARTITION BY COALESCE(product_category, ''), product, location, delivery_window
+                ORDER BY sell_price, supplier
+              ) AS rn
+            FROM {table}
+            WHERE snapshot_id = ?
+        )
+        WHERE rn = 1
+    """, (int(margin_version), snapshot_id))
+
+
+def _refresh_latest_boards(cur, margin_version):
+    """Rebuild the board of each book's latest snapshot; older ones rebuild when read."""
+    for table, snapshots in SNAPSHOT_TABLES.items():
+        cur.execute(f"SELECT snapshot_id FROM {snapshots} ORDER BY published_at_utc DESC LIMIT 1")
+        row = cur.fetchone()
+        if row:
+            _build_best_prices(cur, table, row[0], margin_version)
+
+
+def _load_best_prices(table, snapshot_id, filters) -> pd.DataFrame:
+    with transaction() as c:
+        cur = c.cursor()
+        version = _get_version(cur, "margins")
+        cur.execute("SELECT 1 FROM best_prices WHERE snapshot_id = ? AND margin_version = ? LIMIT 1", (snapshot_id, version))
+        if not cur.fetchone():
+            _build_best_prices(cur, table, snapshot_id, version)
+
+        where = ["snapshot_id = ?", "margin_version = ?"]
+        params = [snapshot_id, version]
+        for name, value in filters.items():
+            if value is not None:
+                where.append(f"{_BOARD_FILTERS[name]} = ?")
+                params.append(value)
+
+        df = pd.read_sql_query(f"""
+            SELECT
+              product_category AS "Product Category",
+              product AS "Product",
+              location AS "Location",
+              delivery_window AS "Delivery Window",
+              best_price AS "Best Price",
+              unit AS "Unit",
+              supplier AS "Supplier"
+            FROM best_prices
+            WHERE {" AND ".join(where)}
+            ORDER BY product_category, product, location, delivery_window
+        """, c, params=params)
+    return df
+
+
+def load_supplier_best_prices(snapshot_id: str, category=None, product=None, location=None, window=None) -> pd.DataFrame:
+    return _load_best_prices("supplier_prices", snapshot_id, {
+        "category": category, "product": product, "location": location, "window": window,
+    })
+
+
+def load_seed_best_prices(snapshot_id: str, category=None, product=None, location=None, window=None) -> pd.DataFrame:
+    return _load_best_prices("seed_prices", snapshot_id, {
+        "category": category, "product": product, "location": location, "window": window,
+    })
+
+
 # ---------------- Small-lot tiers ----------------
 
 def get_small_lot_tiers() -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT tier_id, min_t, max_t, charge_per_t, active
-        FROM small_lot_tiers
-        ORDER BY min_t ASC
-    """, c)
-    c.close()
+    return _memoised("tiers", "small_lot_tiers", _load_small_lot_tiers).copy()
+
+
+def _load_small_lot_tiers() -> pd.DataFrame:
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT tier_id, min_t, max_t, charge_per_t, active
+            FROM small_lot_tiers
+            ORDER BY min_t ASC
+        """, c)
     return df
 
 
@@ -467,31 +906,34 @@ def save_small_lot_tiers(df: pd.DataFrame):
         if _end(active.loc[i]) >= float(active.loc[i + 1, "min_t"]):
             raise ValueError("Overlapping active tiers detected. Adjust min/max so tiers do not overlap.")
 
-    c = conn()
-    cur = c.cursor()
-    cur.execute("DELETE FROM small_lot_tiers;")
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("DELETE FROM small_lot_tiers;")
 
-    rows = []
-    for r in tiers.to_dict("records"):
-        rows.append((
-            float(r["min_t"]),
-            r["max_t"],
-            float(r["charge_per_t"]),
-            int(r["active"]),
-        ))
+        rows = []
+        for r in tiers.to_dict("records"):
+            rows.append((
+                float(r["min_t"]),
+                r["max_t"],
+                float(r["charge_per_t"]),
+                int(r["active"]),
+            ))
 
-    cur.executemany("""
-        INSERT INTO small_lot_tiers (min_t, max_t, charge_per_t, active)
-        VALUES (?, ?, ?, ?)
-    """, rows)
+        cur.executemany("""
+            INSERT INTO small_lot_tiers (min_t, max_t, charge_per_t, active)
+            VALUES (?, ?, ?, ?)
+        """, rows)
+        _bump_version(cur, "tiers")
 
-    c.commit()
-    c.close()
 
 
 # ---------------- Margins ----------------
 
 def add_margin(scope_type: str, scope_value: str, margin_per_t: float, user: str):
+    """
+    Add a margin and re-price only the rows in its scope.
+    Returns (scope_type, scope_value, new margin_version).
+    """
     scope_type = str(scope_type).strip().lower()
     if scope_type not in ("category", "product"):
         raise ValueError("scope_type must be 'category' or 'product'.")
@@ -499,53 +941,72 @@ def add_margin(scope_type: str, scope_value: str, margin_per_t: float, user: str
     if not scope_value:
         raise ValueError("scope_value cannot be empty.")
 
-    c = conn()
-    cur = c.cursor()
-    cur.execute("""
-        INSERT INTO price_margins
-        (scope_type, scope_value, margin_per_t, active, created_at_utc, created_by)
-        VALUES (?, ?, ?, 1, ?, ?)
-    """, (scope_type, scope_value, float(margin_per_t), utc_now_iso(), user))
-    c.commit()
-    c.close()
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("""
+            INSERT INTO price_margins
+            (scope_type, scope_value, margin_per_t, active, created_at_utc, created_by)
+            VALUES (?, ?, ?, 1, ?, ?)
+        """, (scope_type, scope_value, float(margin_per_t), utc_now_iso(), user))
+        for table in PRICE_TABLES:
+            _reprice(cur, table, scope=(scope_type, scope_value))
+        version = _bump_version(cur, "margins")
+        _refresh_latest_boards(cur, version)
+    return scope_type, scope_value, version
 
 
 def list_margins(active_only: bool = True) -> pd.DataFrame:
-    c = conn()
-    if active_only:
-        df = pd.read_sql_query("""
-            SELECT margin_id, scope_type, scope_value, margin_per_t, active, created_at_utc, created_by
-            FROM price_margins
-            WHERE active = 1
-            ORDER BY margin_id DESC
-        """, c)
-    else:
-        df = pd.read_sql_query("""
-            SELECT margin_id, scope_type, scope_value, margin_per_t, active, created_at_utc, created_by
-            FROM price_margins
-            ORDER BY margin_id DESC
-        """, c)
-    c.close()
+    with transaction() as c:
+        if active_only:
+            df = pd.read_sql_query("""
+                SELECT margin_id, scope_type, scope_value, margin_per_t, active, created_at_utc, created_by
+                FROM price_margins
+                WHERE active = 1
+                ORDER BY margin_id DESC
+            """, c)
+        else:
+            df = pd.read_sql_query("""
+                SELECT margin_id, scope_type, scope_value, margin_per_t, active, created_at_utc, created_by
+                FROM price_margins
+                ORDER BY margin_id DESC
+            """, c)
     return df
 
 
 def deactivate_margin(margin_id: int):
-    c = conn()
-    cur = c.cursor()
-    cur.execute("UPDATE price_margins SET active = 0 WHERE margin_id = ?", (int(margin_id),))
-    c.commit()
-    c.close()
+    """
+    Deactivate a margin and re-price only the rows in its scope.
+    Returns (scope_type, scope_value, new margin_version), or None if the
+    margin was not active.
+    """
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("SELECT scope_type, scope_value FROM price_margins WHERE margin_id = ? AND active = 1", (int(margin_id),))
+        row = cur.fetchone()
+        if not row:
+            return None
+
+        cur.execute("UPDATE price_margins SET active = 0 WHERE margin_id = ?", (int(margin_id),))
+        for table in PRICE_TABLES:
+            _reprice(cur, table, scope=row)
+        version = _bump_version(cur, "margins")
+        _refresh_latest_boards(cur, version)
+    return row[0], row[1], version
+
+
+def get_margin_version() -> int:
+    """Counter bumped by every margin change; cache keys for sell prices use it."""
+    return data_versions()["margins"]
 
 
 def get_effective_margins() -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT margin_id, scope_type, scope_value, margin_per_t
-        FROM price_margins
-        WHERE active = 1
-        ORDER BY margin_id DESC
-    """, c)
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT margin_id, scope_type, scope_value, margin_per_t
+            FROM price_margins
+            WHERE active = 1
+            ORDER BY margin_id DESC
+        """, c)
 
     if df.empty:
         return pd.DataFrame(columns=["scope_type", "scope_value", "margin_per_t"])
@@ -594,6 +1055,8 @@ def _add_action(cur, order_id: str, action_type: str, action_by: str, payload: d
         action_by,
         None if payload is None else json.dumps(payload)
     ))
+    # Every order write records an action, so this is the one place to bump.
+    _bump_version(cur, "orders")
 
 def _transition_order(
     order_id: str,
@@ -617,85 +1080,78 @@ def _transition_order(
     if action_type not in ("SUBMIT", "CANCEL", "COUNTER", "ACCEPT_COUNTER", "CONFIRM", "REJECT", "FILL"):
         raise ValueError(f"Unknown action_type: {action_type}")
 
-    c = conn()
-    cur = c.cursor()
-
-    # Load current status and version
-    cur.execute("SELECT status, version, created_by FROM orders WHERE order_id = ?", (order_id,))
-    row = cur.fetchone()
-    if not row:
-        c.close()
-        raise ValueError("Order not found.")
-
-    cur_status = row[0]
-    cur_version = int(row[1] or 0)
-
-    # Optimistic locking check
-    if expected_version is not None and int(expected_version) != cur_version:
-        c.close()
-        raise ValueError("Order changed since you opened it. Refresh and try again.")
-
-    # Validate transition (SUBMIT is handled during create)
-    if action_type != "SUBMIT":
-        allowed = ALLOWED_TRANSITIONS.get(cur_status, {})
-        if action_type not in allowed:
-            c.close()
-            raise ValueError(f"Invalid transition: {cur_status} -> ? via {action_type}")
-        new_status = allowed[action_type]
-    else:
-        new_status = cur_status  # not used
-
-    # If COUNTER and edited_lines provided: update sell_price per line_no
-    if action_type == "COUNTER" and edited_lines is not None:
-        work = edited_lines.copy()
-        if "line_no" not in work.columns:
-            c.close()
-            raise ValueError("edited_lines must include line_no.")
-        if "Sell Price" not in work.columns:
-            c.close()
-            raise ValueError("edited_lines must include 'Sell Price'.")
-
-        work["Sell Price"] = pd.to_numeric(work["Sell Price"], errors="raise")
-
-        # Update each line sell_price (MVP behaviour you already had)
-        for _, r in work.iterrows():
-            ln = int(r["line_no"])
-            sp = float(r["Sell Price"])
+    with transaction() as c:
+        cur = c.cursor()
+
+        # Load current status and version
+        cur.execute("SELECT status, version, created_by FROM orders WHERE order_id = ?", (order_id,))
+        row = cur.fetchone()
+        if not row:
+            raise ValueError("Order not found.")
+
+        cur_status = row[0]
+        cur_version = int(row[1] or 0)
+
+        # Optimistic locking check
+        if expected_version is not None and int(expected_version) != cur_version:
+            raise ValueError("Order changed since you opened it. Refresh and try again.")
+
+        # Validate transition (SUBMIT is handled during create)
+        if action_type != "SUBMIT":
+            allowed = ALLOWED_TRANSITIONS.get(cur_status, {})
+            if action_type not in allowed:
+                raise ValueError(f"Invalid transition: {cur_status} -> ? via {action_type}")
+            new_status = allowed[action_type]
+        else:
+            new_status = cur_status  # not used
+
+        # If COUNTER and edited_lines provided: update sell_price per line_no
+        if action_type == "COUNTER" and edited_lines is not None:
+            work = edited_lines.copy()
+            if "line_no" not in work.columns:
+                raise ValueError("edited_lines must include line_no.")
+            if "Sell Price" not in work.columns:
+                raise ValueError("edited_lines must include 'Sell Price'.")
+
+            work["Sell Price"] = pd.to_numeric(work["Sell Price"], errors="raise")
+
+            # Update each line sell_price (MVP behaviour you already had)
+            for _, r in work.iterrows():
+                ln = int(r["line_no"])
+                sp = float(r["Sell Price"])
+                cur.execute("""
+                    UPDATE order_lines
+                    SET sell_price = ?
+                    WHERE order_id = ? AND line_no = ?
+                """, (sp, order_id, ln))
+
+        # Update admin note if provided
+        if admin_note is not None:
+            cur.execute("UPDATE orders SET admin_note = ? WHERE order_id = ?", (admin_note, order_id))
+
+        # Audit action
+        _add_action(cur, order_id, action_type, action_by, payload)
+
+        # Apply status change + last action + bump version
+        if action_type != "SUBMIT":
             cur.execute("""
-                UPDATE order_lines
-                SET sell_price = ?
-                WHERE order_id = ? AND line_no = ?
-            """, (sp, order_id, ln))
-
-    # Update admin note if provided
-    if admin_note is not None:
-        cur.execute("UPDATE orders SET admin_note = ? WHERE order_id = ?", (admin_note, order_id))
-
-    # Audit action
-    _add_action(cur, order_id, action_type, action_by, payload)
-
-    # Apply status change + last action + bump version
-    if action_type != "SUBMIT":
-        cur.execute("""
-            UPDATE orders
-            SET status = ?,
-                last_action_at_utc = ?,
-                last_action_by = ?,
-                version = version + 1
-            WHERE order_id = ?
-        """, (new_status, utc_now_iso(), action_by, order_id))
-    else:
-        # If you ever call SUBMIT here, still bump version to be consistent
-        cur.execute("""
-            UPDATE orders
-            SET last_action_at_utc = ?,
-                last_action_by = ?,
-                version = version + 1
-            WHERE order_id = ?
-        """, (utc_now_iso(), action_by, order_id))
+                UPDATE orders
+                SET status = ?,
+                    last_action_at_utc = ?,
+                    last_action_by = ?,
+                    version = version + 1
+                WHERE order_id = ?
+            """, (new_status, utc_now_iso(), action_by, order_id))
+        else:
+            # If you ever call SUBMIT here, still bump version to be consistent
+            cur.execute("""
+                UPDATE orders
+                SET last_action_at_utc = ?,
+                    last_action_by = ?,
+                    version = version + 1
+                WHERE order_id = ?
+            """, (utc_now_iso(), action_by, order_id))
 
-    c.commit()
-    c.close()
 
 def create_order_from_allocation(
     created_by: str,
@@ -713,107 +1169,101 @@ def create_order_from_allocation(
     order_id = str(uuid.uuid4())
     now = utc_now_iso()
 
-    c = conn()
-    cur = c.cursor()
+    with transaction() as c:
+        cur = c.cursor()
 
-    cur.execute("""
-        INSERT INTO orders
-        (order_id, created_at_utc, created_by, status, supplier_snapshot_id, last_action_at_utc, last_action_by, trader_note, admin_note, version)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
-    """, (order_id, now, created_by, "PENDING", supplier_snapshot_id, now, created_by, trader_note, ""))
-
-    rows = []
-    for i, ln in enumerate(allocation_lines, start=1):
-        rows.append((
-            order_id,
-            i,
-            str(ln.get("Product Category", "")).strip(),
-            str(ln["Product"]).strip(),
-            str(ln.get("Location", "")).strip(),
-            str(ln["Delivery Window"]).strip(),
-            float(ln["Qty"]),
-            str(ln.get("Unit", "£/t")).strip(),
-            str(ln["Supplier"]).strip(),
-            float(ln["Base Price"]),
-            float(ln["Sell Price"]),
-        ))
-
-    cur.executemany("""
-        INSERT INTO order_lines
-        (order_id, line_no, product_category, product, location, delivery_window, qty, unit, supplier, base_price, sell_price)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, rows)
-
-    _add_action(cur, order_id, "SUBMIT", created_by, {"lines": len(rows)})
+        cur.execute("""
+            INSERT INTO orders
+            (order_id, created_at_utc, created_by, status, supplier_snapshot_id, last_action_at_utc, last_action_by, trader_note, admin_note, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+        """, (order_id, now, created_by, "PENDING", supplier_snapshot_id, now, created_by, trader_note, ""))
+
+        rows = []
+        for i, ln in enumerate(allocation_lines, start=1):
+            rows.append((
+                order_id,
+                i,
+                str(ln.get("Product Category", "")).strip(),
+                str(ln["Product"]).strip(),
+                str(ln.get("Location", "")).strip(),
+                str(ln["Delivery Window"]).strip(),
+                float(ln["Qty"]),
+                str(ln.get("Unit", "£/t")).strip(),
+                str(ln["Supplier"]).strip(),
+                float(ln["Base Price"]),
+                float(ln["Sell Price"]),
+            ))
 
-    cur.execute("""
-        UPDATE orders
-        SET last_action_at_utc = ?, last_action_by = ?, status = 'PENDING'
-        WHERE order_id = ?
-    """, (utc_now_iso(), created_by, order_id))
+        cur.executemany("""
+            INSERT INTO order_lines
+            (order_id, line_no, product_category, product, location, delivery_window, qty, unit, supplier, base_price, sell_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+        _add_action(cur, order_id, "SUBMIT", created_by, {"lines": len(rows)})
+
+        cur.execute("""
+            UPDATE orders
+            SET last_action_at_utc = ?, last_action_by = ?, status = 'PENDING'
+            WHERE order_id = ?
+        """, (utc_now_iso(), created_by, order_id))
 
-    c.commit()
-    c.close()
     return order_id
 
 
 def list_orders_for_user(user: str) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT order_id, created_at_utc, status, supplier_snapshot_id, last_action_at_utc, trader_note
-        FROM orders
-        WHERE created_by = ?
-        ORDER BY created_at_utc DESC
-    """, c, params=(user,))
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT order_id, created_at_utc, status, supplier_snapshot_id, last_action_at_utc, trader_note
+            FROM orders
+            WHERE created_by = ?
+            ORDER BY created_at_utc DESC
+        """, c, params=(user,))
     return df
 
 
 def list_orders_admin(status_filter: str | None = None) -> pd.DataFrame:
-    c = conn()
-    if status_filter:
-        df = pd.read_sql_query("""
-            SELECT order_id, created_at_utc, created_by, status, supplier_snapshot_id, last_action_at_utc, last_action_by
-            FROM orders
-            WHERE status = ?
-            ORDER BY created_at_utc DESC
-        """, c, params=(status_filter,))
-    else:
-        df = pd.read_sql_query("""
-            SELECT order_id, created_at_utc, created_by, status, supplier_snapshot_id, last_action_at_utc, last_action_by
-            FROM orders
-            ORDER BY created_at_utc DESC
-        """, c)
-    c.close()
+    with transaction() as c:
+        if status_filter:
+            df = pd.read_sql_query("""
+                SELECT order_id, created_at_utc, created_by, status, supplier_snapshot_id, last_action_at_utc, last_action_by
+                FROM orders
+                WHERE status = ?
+                ORDER BY created_at_utc DESC
+            """, c, params=(status_filter,))
+        else:
+            df = pd.read_sql_query("""
+                SELECT order_id, created_at_utc, created_by, status, supplier_snapshot_id, last_action_at_utc, last_action_by
+                FROM orders
+                ORDER BY created_at_utc DESC
+            """, c)
     return df
 
 
 def get_order_lines(order_id: str) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT line_no, product_category AS "Product Category", product AS "Product",
-               location AS "Location", delivery_window AS "Delivery Window",
-               qty AS "Qty", unit AS "Unit", supplier AS "Supplier",
-               base_price AS "Base Price", sell_price AS "Sell Price"
-        FROM order_lines
-        WHERE order_id = ?
-        ORDER BY line_no ASC
-    """, c, params=(order_id,))
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT line_no, product_category AS "Product Category", product AS "Product",
+                   location AS "Location", delivery_window AS "Delivery Window",
+                   qty AS "Qty", unit AS "Unit", supplier AS "Supplier",
+                   base_price AS "Base Price", sell_price AS "Sell Price"
+            FROM order_lines
+            WHERE order_id = ?
+            ORDER BY line_no ASC
+        """, c, params=(order_id,))
     return df
 
 
 def get_order_header(order_id: str) -> dict | None:
-    c = conn()
-    cur = c.cursor()
-    cur.execute("""
-        SELECT order_id, created_at_utc, created_by, status, supplier_snapshot_id,
-               last_action_at_utc, last_action_by, trader_note, admin_note, version
-        FROM orders
-        WHERE order_id = ?
-    """, (order_id,))
-    row = cur.fetchone()
-    c.close()
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("""
+            SELECT order_id, created_at_utc, created_by, status, supplier_snapshot_id,
+                   last_action_at_utc, last_action_by, trader_note, admin_note, version
+            FROM orders
+            WHERE order_id = ?
+        """, (order_id,))
+        row = cur.fetchone()
 
     if not row:
         return None
@@ -827,14 +1277,13 @@ def get_order_header(order_id: str) -> dict | None:
     return out
 
 def get_order_actions(order_id: str) -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT action_id, action_type, action_at_utc, action_by, payload_json
-        FROM order_actions
-        WHERE order_id = ?
-        ORDER BY action_at_utc ASC
-    """, c, params=(order_id,))
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT action_id, action_type, action_at_utc, action_by, payload_json
+            FROM order_actions
+            WHERE order_id = ?
+            ORDER BY action_at_utc ASC
+        """, c, params=(order_id,))
     return df
 
 
@@ -959,18 +1408,16 @@ def presence_heartbeat(user: str, role: str, page: str, session_id: str):
 
     now = utc_now_iso()
 
-    c = conn()
-    cur = c.cursor()
-    cur.execute("""
-        INSERT INTO user_presence (user, session_id, role, page, online_since_utc, last_seen_utc)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(user, session_id) DO UPDATE SET
-            role = excluded.role,
-            page = excluded.page,
-            last_seen_utc = excluded.last_seen_utc
-    """, (user, session_id, role, page, now, now))
-    c.commit()
-    c.close()
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("""
+            INSERT INTO user_presence (user, session_id, role, page, online_since_utc, last_seen_utc)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user, session_id) DO UPDATE SET
+                role = excluded.role,
+                page = excluded.page,
+                last_seen_utc = excluded.last_seen_utc
+        """, (user, session_id, role, page, now, now))
 
 
 def presence_signoff(user: str, session_id: str):
@@ -980,11 +1427,9 @@ def presence_signoff(user: str, session_id: str):
     if not user or not session_id:
         return
 
-    c = conn()
-    cur = c.cursor()
-    cur.execute("DELETE FROM user_presence WHERE user = ? AND session_id = ?", (user, session_id))
-    c.commit()
-    c.close()
+    with transaction() as c:
+        cur = c.cursor()
+        cur.execute("DELETE FROM user_presence WHERE user = ? AND session_id = ?", (user, session_id))
 
 
 def list_online_users(online_within_seconds: int = 45) -> pd.DataFrame:
@@ -994,21 +1439,19 @@ def list_online_users(online_within_seconds: int = 45) -> pd.DataFrame:
     """
     cutoff = (datetime.now(timezone.utc) - timedelta(seconds=int(online_within_seconds))).isoformat(timespec="seconds")
 
-    c = conn()
-    cur = c.cursor()
-
-    # Cleanup stale sessions (optional but recommended)
-    cur.execute("DELETE FROM user_presence WHERE last_seen_utc < ?", (cutoff,))
-    c.commit()
-
-    df = pd.read_sql_query("""
-        SELECT user, role, page, MIN(online_since_utc) AS online_since_utc, MAX(last_seen_utc) AS last_seen_utc
-        FROM user_presence
-        WHERE last_seen_utc >= ?
-        GROUP BY user, role, page
-        ORDER BY user ASC
-    """, c, params=(cutoff,))
-    c.close()
+    with transaction() as c:
+        cur = c.cursor()
+
+        # Cleanup stale sessions (optional but recommended)
+        cur.execute("DELETE FROM user_presence WHERE last_seen_utc < ?", (cutoff,))
+
+        df = pd.read_sql_query("""
+            SELECT user, role, page, MIN(online_since_utc) AS online_since_utc, MAX(last_seen_utc) AS last_seen_utc
+            FROM user_presence
+            WHERE last_seen_utc >= ?
+            GROUP BY user, role, page
+            ORDER BY user ASC
+        """, c, params=(cutoff,))
     return df
 
 def admin_margin_report() -> pd.DataFrame:
@@ -1016,23 +1459,22 @@ def admin_margin_report() -> pd.DataFrame:
     Simple report over FILLED orders:
       margin = sum((sell_price - base_price) * qty)
     """
-    c = conn()
-    df = pd.read_sql_query("""
-        SELECT
-          o.order_id,
-          o.created_at_utc,
-          o.created_by,
-          SUM(ol.qty) AS total_tonnes,
-          SUM(ol.sell_price * ol.qty) AS sell_value,
-          SUM(ol.base_price * ol.qty) AS base_value,
-          SUM((ol.sell_price - ol.base_price) * ol.qty) AS gross_margin
-        FROM orders o
-        JOIN order_lines ol ON ol.order_id = o.order_id
-        WHERE o.status = 'FILLED'
-        GROUP BY o.order_id, o.created_at_utc, o.created_by
-        ORDER BY o.created_at_utc DESC
-    """, c)
-    c.close()
+    with transaction() as c:
+        df = pd.read_sql_query("""
+            SELECT
+              o.order_id,
+              o.created_at_utc,
+              o.created_by,
+              SUM(ol.qty) AS total_tonnes,
+              SUM(ol.sell_price * ol.qty) AS sell_value,
+              SUM(ol.base_price * ol.qty) AS base_value,
+              SUM((ol.sell_price - ol.base_price) * ol.qty) AS gross_margin
+            FROM orders o
+            JOIN order_lines ol ON ol.order_id = o.order_id
+            WHERE o.status = 'FILLED'
+            GROUP BY o.order_id, o.created_at_utc, o.created_by
+            ORDER BY o.created_at_utc DESC
+        """, c)
     return df
 
 def admin_blotter_lines() -> pd.DataFrame:
@@ -1040,29 +1482,28 @@ def admin_blotter_lines() -> pd.DataFrame:
     Line-level blotter for FILLED orders.
     Returns one row per order line with dimensions for filtering.
     """
-    c = conn()
-    q = """
-    SELECT
-        o.order_id,
-        o.created_at_utc,
-        o.created_by,
-        l.line_no,
-        l.product_category  AS product_category,
-        l.product           AS product,
-        l.location          AS location,
-        l.delivery_window   AS delivery_window,
-        l.supplier          AS supplier,
-        l.qty               AS qty,
-        l.base_price        AS base_price,
-        l.sell_price        AS sell_price
-    FROM orders o
-    JOIN order_lines l
-      ON l.order_id = o.order_id
-    WHERE o.status = 'FILLED'
-    ORDER BY o.created_at_utc DESC, o.order_id, l.line_no
-    """
-    df = pd.read_sql_query(q, c)
-    c.close()
+    with transaction() as c:
+        q = """
+        SELECT
+            o.order_id,
+            o.created_at_utc,
+            o.created_by,
+            l.line_no,
+            l.product_category  AS product_category,
+            l.product           AS product,
+            l.location          AS location,
+            l.delivery_window   AS delivery_window,
+            l.supplier          AS supplier,
+            l.qty               AS qty,
+            l.base_price        AS base_price,
+            l.sell_price        AS sell_price
+        FROM orders o
+        JOIN order_lines l
+          ON l.order_id = o.order_id
+        WHERE o.status = 'FILLED'
+        ORDER BY o.created_at_utc DESC, o.order_id, l.line_no
+        """
+        df = pd.read_sql_query(q, c)
     return df
 
 
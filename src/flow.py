@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import heapq
+
+# Flow below this is treated as zero (tonnes).
+FLOW_EPS = 1e-9
+
+
+class MinCostFlow:
+    """
+    Min-cost flow by successive shortest paths (Dijkstra with node potentials).
+
+    Capacities and flows are floats (tonnes), so paths are augmented by their
+    bottleneck rather than one unit at a time. Arc costs must be non-negative;
+    the residual reverse arcs stay non-negative under the reduced costs, which
+    is what keeps every Dijkstra run valid.
+    """
+
+    __slots__ = ("n", "to", "cap", "cost", "adj")
+
+    def __init__(self, n: int):
+        self.n = n
+        self.to: list[int] = []
+        self.cap: list[float] = []
+        self.cost: list[float] = []
+        self.adj: list[list[int]] = [[] for _ in range(n)]
+
+    def add_arc(self, u: int, v: int, cap: float, cost: float) -> int:
+        """Add arc u -> v and its residual twin. Returns the arc id (see flow_on)."""
+        if cost < 0:
+            raise ValueError("MinCostFlow needs non-negative arc costs.")
+        a = len(self.to)
+        self.to += [v, u]
+        self.cap += [float(cap), 0.0]
+        self.cost += [float(cost), -float(cost)]
+        self.adj[u].append(a)
+        self.adj[v].append(a + 1)
+        return a
+
+    def flow_on(self, arc: int) -> float:
+        """Flow currently on an arc returned by add_arc."""
+        return self.cap[arc ^ 1]
+
+    def solve(self, s: int, t: int, demand: float) -> tuple[float, float]:
+        """
+        Send up to `demand` from s to t at minimum cost.
+        Returns (flow sent, total cost); flow sent < demand means infeasible.
+        """
+        n, to, cap, cost, adj = self.n, self.to, self.cap, self.cost, self.adj
+        inf = float("inf")
+        pot = [0.0] * n
+        sent = 0.0
+        total = 0.0
+
+        while demand - sent > FLOW_EPS:
+            dist = [inf] * n
+            via = [-1] * n
+            dist[s] = 0.0
+            heap = [(0.0, s)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                if u == t:
+                    break
+                pu = pot[u]
+                for a in adj[u]:
+                    if cap[a] <= FLOW_EPS:
+                        continue
+                    v = to[a]
+                    # Reduced costs are >= 0 up to rounding.
+                    nd = d + cost[a] + pu - pot[v]
+                    if nd < d:
+                        nd = d
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        via[v] = a
+                        heapq.heappush(heap, (nd, v))
+
+            if via[t] < 0:
+                break
+
+            # Dijkstra stopped at t: nodes not settled by then move by dist[t],
+            # which keeps every reduced cost non-negative.
+            dt = dist[t]
+            for v in range(n):
+                pot[v] += dist[v] if dist[v] < dt else dt
+
+            push = demand - sent
+            v = t
+            while v != s:
+                a = via[v]
+                push = min(push, cap[a])
+                v = to[a ^ 1]
+
+            v = t
+            while v != s:
+                a = via[v]
+                cap[a] -= push
+                cap[a ^ 1] += push
+                total += push * cost[a]
+                v = to[a ^ 1]
+            sent += push
+
+        return sent, total
@@ -1,49 +1,972 @@
 from __future__ import annotations
 
-from itertools import combinations
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from bisect import bisect_right, insort
+from collections import OrderedDict, deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from src.flow import FLOW_EPS, MinCostFlow
+from src.snapshot import is_coded, lookup_codes
+
+# Tolerance used by the tier lookup: bounds are inclusive up to this slack.
+_TIER_EPS = 1e-9
+
+logger = logging.getLogger(__name__)
 
-def tier_charge_per_t(tonnes: float, tiers: pd.DataFrame) -> float:
+
+class TierSchedule:
     """
-    Returns the applicable small-lot charge (£/t) for a given tonnage, using
-    the tier table. Tiers are assumed to be:
-      - global (applies to all suppliers),
-      - non-overlapping for active tiers,
-      - inclusive on both bounds (min_t <= t <= max_t).
-    If max_t is null/NaN, the tier is open-ended.
-    """
-    t = float(tonnes)
-    if t <= 0:
+    Compiled small-lot tier table. Build once per request with from_frame() and
+    reuse for every lookup.
+
+    Lookup semantics match the tier table:
+      - tiers are global (apply to all suppliers),
+      - only active tiers count, taken in min_t order; the first tier with
+        min_t <= t <= max_t (inclusive, within a 1e-9 slack) wins,
+      - max_t null/NaN means open-ended,
+      - tonnages <= 0 or not covered by any tier pay no charge.
+
+    The charge per tonne is piecewise constant, so it is compiled into the sorted
+    boundary tonnages (edges), the charge exactly at each edge and the charge on
+    the open interval after it. A scalar lookup is one bisect.
+    """
+
+    __slots__ = ("tiers", "edges", "at_edge", "after_edge", "below")
+
+    def __init__(self, tiers: list[tuple[float, float | None, float]]):
+        """tiers: active (min_t, max_t or None, charge_per_t) in lookup order."""
+        self.tiers = tuple(tiers)
+
+        edges = set()
+        for mn, mx, _ in self.tiers:
+            edges.add(mn - _TIER_EPS)
+            if mx is not None:
+                edges.add(mx + _TIER_EPS)
+        self.edges = np.array(sorted(edges), dtype=float)
+
+        after = list(self.edges[1:]) + [self.edges[-1] + 1.0] if len(self.edges) else []
+        self.at_edge = np.array([self._match(x) for x in self.edges], dtype=float)
+        self.after_edge = np.array(
+            [self._match((x + y) / 2.0) for x, y in zip(self.edges, after)], dtype=float
+        )
+        self.below = self._match(self.edges[0] - 1.0) if len(self.edges) else 0.0
+
+    @classmethod
+    def from_frame(cls, tiers: pd.DataFrame) -> "TierSchedule":
+        """Compile the small_lot_tiers frame (min_t, max_t, charge_per_t, active)."""
+        # Handle active being bool or int
+        active = tiers[tiers["active"].astype(int) == 1]
+        active = active.sort_values("min_t", kind="mergesort")
+
+        rows = []
+        for r in active.to_dict("records"):
+            mx = r.get("max_t", None)
+
+            # Normalize max_t
+            if mx is None or (isinstance(mx, float) and pd.isna(mx)):
+                mx = None
+            else:
+                mx = float(mx)
+
+            rows.append((float(r["min_t"]), mx, float(r["charge_per_t"])))
+        return cls(rows)
+
+    def _match(self, t: float) -> float:
+        for mn, mx, cpt in self.tiers:
+            if (t + _TIER_EPS) >= mn and (mx is None or (t - _TIER_EPS) <= mx):
+                return cpt
+        # If not covered by tiers, default to no charge
         return 0.0
 
-    # Handle active being bool or int
-    active = tiers[tiers["active"].astype(int) == 1].copy()
-    active = active.sort_values("min_t")
+    def charge_per_t(self, tonnes: float) -> float:
+        """Applicable small-lot charge (£/t) for one tonnage."""
+        t = float(tonnes)
+        if t <= 0:
+            return 0.0
+        j = bisect_right(self.edges, t) - 1
+        if j < 0:
+            return float(self.below)
+        if self.edges[j] == t:
+            return float(self.at_edge[j])
+        return float(self.after_edge[j])
+
+    def charges(self, tonnes: np.ndarray) -> np.ndarray:
+        """Vectorised charge_per_t: £/t for each tonnage in the array."""
+        t = np.asarray(tonnes, dtype=float)
+        if not len(self.edges):
+            return np.zeros_like(t)
+        j = np.searchsorted(self.edges, t, side="right") - 1
+        jc = np.clip(j, 0, None)
+        out = np.where(self.edges[jc] == t, self.at_edge[jc], self.after_edge[jc])
+        out = np.where(j < 0, self.below, out)
+        return np.where(t > 0, out, 0.0)
+
+    def min_charge(self, lo: float, hi: float) -> float:
+        """
+        Lowest small-lot charge (£, tonnes x £/t) payable for any tonnage in
+        [lo, hi]. The charge is non-decreasing on every constant piece, so the
+        minimum sits at lo or at the start of a piece inside the range.
+        """
+        if hi <= 0:
+            return 0.0
+        lo = max(float(lo), 0.0)
+        best = lo * self.charge_per_t(lo)
+        j = bisect_right(self.edges, lo)
+        while j < len(self.edges) and self.edges[j] <= hi and best > 0:
+            x = float(self.edges[j])
+            best = min(best, x * float(self.at_edge[j]))
+            if x < hi:
+                best = min(best, x * float(self.after_edge[j]))
+            j += 1
+        return best
+
+    def min_rate(self, lo: float, hi: float) -> float:
+        """Lowest small-lot charge per tonne (£/t) for any tonnage in [lo, hi]."""
+        if hi <= 0:
+            return 0.0
+        lo = max(float(lo), 0.0)
+        best = self.charge_per_t(lo) if lo > 0 else float(self.charge_per_t(hi))
+        j = bisect_right(self.edges, lo)
+        while j < len(self.edges) and self.edges[j] <= hi and best > 0:
+            best = min(best, float(self.at_edge[j]))
+            if self.edges[j] < hi:
+                best = min(best, float(self.after_edge[j]))
+            j += 1
+        return best
+
+
+def tier_charge_per_t(tonnes: float, tiers: pd.DataFrame | TierSchedule) -> float:
+    """
+    Returns the applicable small-lot charge (£/t) for a given tonnage, using
+    the tier table. See TierSchedule for the lookup rules; pass a compiled
+    schedule when calling this repeatedly.
+    """
+    if not isinstance(tiers, TierSchedule):
+        tiers = TierSchedule.from_frame(tiers)
+    return tiers.charge_per_t(tonnes)
+
+
+# Search tolerance (£). A branch is pruned when its lower bound cannot beat the
+# incumbent by more than this.
+_TOL = 1e-9
+
+
+def _build_cost_matrix(
+    supplier_prices: pd.DataFrame,
+    basket: list[dict]
+) -> tuple[list[str], np.ndarray, np.ndarray] | str:
+    """
+    Dense lines x suppliers price matrix for a basket, built in one merge.
+
+    Returns (suppliers, P, qtys) where suppliers is sorted by name (column
+    order, which is also the tie-break order), P[i, j] is the price supplier j
+    quotes for basket line i (+inf where it does not quote) and qtys are the
+    line tonnages. Returns an error message if a line has no prices.
+    """
+    keys = ["Product", "Location", "Delivery Window"]
+    lines = pd.DataFrame(
+        [[line["Product"], line["Location"], line["Delivery Window"]] for line in basket],
+        columns=keys
+    )
+    lines["_line"] = np.arange(len(basket))
+
+    prices = supplier_prices[keys + ["Supplier", "Price"]]
+    if all(is_coded(prices[k]) for k in keys):
+        # Compact snapshot: join on the integer codes rather than the strings.
+        for k in keys:
+            lines[k] = lookup_codes(prices[k], lines[k])
+        prices = prices.assign(**{k: prices[k].cat.codes.to_numpy() for k in keys})
+
+    quotes = lines.merge(prices, on=keys, how="inner")
+
+    priced = np.zeros(len(basket), dtype=bool)
+    priced[quotes["_line"].to_numpy()] = True
+    if not priced.all():
+        line = basket[int(np.flatnonzero(~priced)[0])]
+        return f"No supplier prices for {line['Product']} @ {line['Location']} {line['Delivery Window']}"
+
+    suppliers = sorted(quotes["Supplier"].astype(str).unique().tolist())
+    col = pd.Series(np.arange(len(suppliers)), index=suppliers)
+
+    P = np.full((len(basket), len(suppliers)), np.inf)
+    # Keep the cheapest quote if a supplier somehow quotes a line twice.
+    np.minimum.at(
+        P,
+        (quotes["_line"].to_numpy(), col.loc[quotes["Supplier"].astype(str)].to_numpy()),
+        quotes["Price"].astype(float).to_numpy()
+    )
+
+    qtys = np.array([float(line["Qty"]) for line in basket], dtype=float)
+    return suppliers, P, qtys
+
 
-    eps = 1e-9
+class PriceIndex:
+    """
+    Supplier quotes grouped by (product, location, delivery window), built
+    once per snapshot so many baskets can be costed without re-filtering the
+    price frame. cost_matrix(basket) gives the same result as
+    _build_cost_matrix(supplier_prices, basket).
+    """
+
+    __slots__ = ("suppliers", "quotes")
+
+    def __init__(self, supplier_prices: pd.DataFrame):
+        keys = ["Product", "Location", "Delivery Window"]
+        df = supplier_prices[keys + ["Supplier", "Price"]].copy()
+        if not is_coded(df["Supplier"]):
+            df["Supplier"] = pd.Categorical(df["Supplier"].astype(str))
+        df["Price"] = df["Price"].astype(float)
+        # Keep the cheapest quote if a supplier somehow quotes a line twice.
+        df = df.groupby(keys + ["Supplier"], sort=False, as_index=False, observed=True)["Price"].min()
+
+        # Supplier columns come straight from the codes, in name order.
+        names = np.asarray(df["Supplier"].cat.categories.astype(str), dtype=object)
+        codes = df["Supplier"].cat.codes.to_numpy()
+        used = np.unique(codes)
+        used = used[np.argsort(names[used], kind="stable")]
+        self.suppliers = names[used].tolist()
+        col = np.full(len(names), -1)
+        col[used] = np.arange(len(used))
+        df["_col"] = col[codes]
+
+        self.quotes: dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+        for key, grp in df.groupby(keys, sort=False, observed=True):
+            grp = grp.sort_values("_col")
+            self.quotes[key] = (grp["_col"].to_numpy(), grp["Price"].to_numpy())
+
+    def cost_matrix(self, basket: list[dict]) -> tuple[list[str], np.ndarray, np.ndarray] | str:
+        """(suppliers, P, qtys) for a basket, or an error message; see _build_cost_matrix."""
+        found = []
+        for line in basket:
+            q = self.quotes.get((line["Product"], line["Location"], line["Delivery Window"]))
+            if q is None:
+                return f"No supplier prices for {line['Product']} @ {line['Location']} {line['Delivery Window']}"
+            found.append(q)
+
+        used = np.unique(np.concatenate([cols for cols, _ in found])) if found else np.array([], dtype=int)
+        local = np.full(len(self.suppliers), -1)
+        local[used] = np.arange(len(used))
+
+        P = np.full((len(basket), len(used)), np.inf)
+        for i, (cols, prices) in enumerate(found):
+            P[i, local[cols]] = prices
+
+        qtys = np.array([float(line["Qty"]) for line in basket], dtype=float)
+        return [self.suppliers[j] for j in used], P, qtys
+
+
+def _basket_matrix(
+    supplier_prices: pd.DataFrame | PriceIndex,
+    basket: list[dict]
+) -> tuple[list[str], np.ndarray, np.ndarray] | str:
+    """(suppliers, P, qtys) from a price frame or PriceIndex, or an error message."""
+    if isinstance(supplier_prices, PriceIndex):
+        return supplier_prices.cost_matrix(basket)
+
+    required_sp = {"Supplier", "Product", "Location", "Delivery Window", "Price"}
+    missing_sp = required_sp - set(supplier_prices.columns)
+    if missing_sp:
+        return f"supplier_prices missing columns: {sorted(missing_sp)}"
+    return _build_cost_matrix(supplier_prices, basket)
+
+
+def _merge_excess(schedule: TierSchedule, xs: np.ndarray, total: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Worst extra small-lot charge from merging x tonnes onto a supplier that
+    already carries t: charge(t + x) - charge(t) - charge(x), for every t in
+    [0, total - x]. Evaluated at every x in `xs` and at the x where two tier
+    boundaries meet, so that between consecutive returned x the worst case is
+    linear. Returns (x, worst) sorted by x.
+
+    The charge (tonnes x £/t) is linear on each tier piece, so over the
+    (x, t) region the excess is linear on the cells cut out by the lines
+    x = edge, t = edge and x + t = edge; its supremum sits at a cell corner.
+    Every corner is sampled together with points a hair inside each
+    neighbouring cell.
+    """
+    edges = schedule.edges[(schedule.edges > 0) & (schedule.edges < total)]
+    gaps = np.diff(np.concatenate(([0.0], edges, [total])))
+    delta = min(1e-7, float(gaps[gaps > 0].min(initial=1.0)) / 8.0)
+    nudges = np.arange(-2, 3) * delta
+
+    x = np.concatenate((xs, edges, total - edges, (edges[:, None] - edges[None, :]).ravel()))
+    x = np.unique(x[(x > 0) & (x <= total)])
+    xn = (x[:, None] + nudges[None, :]).ravel()
+    xn = xn[(xn > 0) & (xn <= total)]
+
+    t = np.concatenate((
+        np.zeros((len(xn), 1)), (total - xn)[:, None],
+        np.broadcast_to(edges, (len(xn), len(edges))), edges[None, :] - xn[:, None],
+    ), axis=1)
+    t = (t[:, :, None] + nudges[None, None, :]).reshape(len(xn), -1)
+    ok = (t >= 0) & (t <= (total - xn)[:, None])
+    t = np.where(ok, t, 0.0)
+
+    def charge(y):
+        return y * schedule.charges(y)
+
+    excess = charge(t + xn[:, None]) - charge(t) - charge(xn)[:, None]
+    worst = np.where(ok, excess, -np.inf).max(axis=1)
+    order = np.argsort(xn, kind="mergesort")
+    return xn[order], worst[order]
+
+
+def _dominated_suppliers(P: np.ndarray, qtys: np.ndarray, schedule: TierSchedule) -> np.ndarray:
+    """
+    Mask of supplier columns that can be dropped before the search.
+
+      - Duplicates: a supplier quoting exactly the same prices on exactly the
+        same lines as an earlier (by name) supplier can be swapped for it in
+        any allocation at no cost. Keep the first.
+      - Dominated: supplier b quotes every line supplier a quotes, at least d
+        £/t cheaper on each. Take any allocation giving a some lines, x
+        tonnes, and b t tonnes, and move a's lines to b: the price saving is
+        at least d * x and the small-lot charges rise by at most
+        charge(t + x) - charge(t) - charge(x) (nobody else's tonnes change).
+        If the saving beats that for every x a could carry and every t b
+        could (see _merge_excess), some optimal allocation never uses a.
+        Allocations are not assumed to be cheapest-in-set, so this holds for
+        the local-search polish and the heuristic engine as well.
+
+    The excess is 0 at t = 0, so dominance needs d > 0 on a line set that b
+    covers: it is acyclic, and every dropped supplier still has a kept
+    supplier that dominates it.
+    """
+    k = P.shape[1]
+    quoted = np.isfinite(P)
+    total = float(qtys.sum())
+    drop = np.zeros(k, dtype=bool)
+
+    lo = np.array([
+        qtys[quoted[:, a] & (qtys > 0)].min(initial=np.inf) for a in range(k)
+    ])
+    hi = qtys @ quoted
+    live = np.isfinite(lo)
+    xs, worst = _merge_excess(schedule, np.concatenate((lo[live], hi[live])), total)
+
+    for a in range(k):
+        mine = quoted[:, a]
+        same_lines = (quoted == mine[:, None]).all(axis=0)
+        same_prices = (np.where(quoted, P, 0.0) == np.where(mine, P[:, a], 0.0)[:, None]).all(axis=0)
+        if (same_lines & same_prices)[:a].any():
+            drop[a] = True
+            continue
+        if not live[a]:
+            continue
+
+        covers = quoted[mine].all(axis=0)
+        covers[a] = False
+        if not covers.any():
+            continue
+        with np.errstate(invalid="ignore"):
+            d = (P[mine, a][:, None] - P[mine][:, covers]).min(axis=0)
+        span = (xs >= lo[a]) & (xs <= hi[a])
+        excess = (worst[span][:, None] - xs[span][:, None] * d[None, :]).max(axis=0)
+        if (excess < -1e-6).any():
+            drop[a] = True
+
+    return drop
+
+
+def _cover_order(quoted: np.ndarray, wins: np.ndarray) -> list[int]:
+    """
+    Branching order over supplier columns, set-cover style: repeatedly take
+    the supplier covering the most not-yet-covered lines, weighting each line
+    by 1 / (number of suppliers quoting it) so scarce lines are settled near
+    the root. Once every line is covered the rest follow by lines won outright.
+    """
+    k = quoted.shape[1]
+    weight = 1.0 / quoted.sum(axis=1)
+    uncovered = np.ones(quoted.shape[0], dtype=bool)
+    left = set(range(k))
+    order = []
+    while left and uncovered.any():
+        score = {j: float(weight[quoted[:, j] & uncovered].sum()) for j in left}
+        j = min(left, key=lambda j: (-score[j], -int(wins[j]), j))
+        order.append(j)
+        left.remove(j)
+        uncovered &= ~quoted[:, j]
+    order.extend(sorted(left, key=lambda j: (-int(wins[j]), j)))
+    return order
 
-    for r in active.to_dict("records"):
-        mn = float(r["min_t"])
-        mx = r.get("max_t", None)
 
-        # Normalize max_t
-        if mx is None or (isinstance(mx, float) and pd.isna(mx)):
-            mx = None
+def _rank(res: tuple[float, np.ndarray]) -> tuple:
+    """
+    Incumbent order: lower total first, then the lexicographically smaller
+    per-line supplier choice. A total order, so the ranking does not depend on
+    the order the search visits sets in (serial and parallel runs agree).
+    """
+    return res[0], tuple(int(j) for j in res[1])
+
+
+class _Incumbents:
+    """
+    Bounded pool of the K best distinct allocations found so far, best first.
+    Allocations are (total, choice); two supplier sets that end up with the
+    same per-line choice count once.
+    """
+
+    __slots__ = ("size", "items", "seen")
+
+    def __init__(self, size: int):
+        self.size = max(int(size), 1)
+        self.items: list[tuple[tuple, tuple[float, np.ndarray]]] = []
+        self.seen: set[bytes] = set()
+
+    @property
+    def best(self) -> tuple[float, np.ndarray]:
+        return self.items[0][1]
+
+    @property
+    def bound(self) -> float:
+        """Total a new allocation must reach to enter the pool."""
+        return self.items[-1][1][0] if len(self.items) >= self.size else np.inf
+
+    def offer(self, res: tuple[float, np.ndarray]) -> bool:
+        """Add an allocation if it ranks in the top K. Returns True if kept."""
+        key = res[1].tobytes()
+        if key in self.seen:
+            return False
+        if len(self.items) >= self.size and res[0] > self.bound:
+            return False
+        rank = _rank(res)
+        if len(self.items) >= self.size and rank >= self.items[-1][0]:
+            return False
+        insort(self.items, (rank, res), key=lambda item: item[0])
+        self.seen.add(key)
+        if len(self.items) > self.size:
+            _, dropped = self.items.pop()
+            self.seen.discard(dropped[1].tobytes())
+        return True
+
+    def ranked(self) -> list[tuple[float, np.ndarray]]:
+        return [res for _, res in self.items]
+
+
+# Search counters (see optimise_basket stats).
+_COUNTERS = ("evaluated", "pruned", "infeasible", "redundant", "tier_lookups")
+
+
+def _new_counts() -> dict:
+    return dict.fromkeys(_COUNTERS, 0)
+
+
+class _SupplierSearch:
+    """
+    Branch-and-bound over supplier sets for one basket's cost matrix (see
+    optimise_basket). Picklable, so subtrees can be searched in worker processes.
+
+    A node is (depth, inc_bits, inc, bound): suppliers order[:depth] are
+    decided, inc (bool mask) / inc_bits (bitmask) are the included ones,
+    order[depth:] are undecided and bound is a lower bound valid for the whole
+    subtree. An incumbent is (total, choice), choice being the supplier column
+    serving each line.
+    """
+
+    def __init__(self, P: np.ndarray, qtys: np.ndarray, schedule: TierSchedule):
+        self.P = P
+        self.qtys = qtys
+        self.schedule = schedule
+        self.k = P.shape[1]
+        self.quoted = np.isfinite(P)
+        self.rows = np.arange(P.shape[0])
+
+        # Coverage index: bit j of line_bits[i] is set when supplier j quotes line i.
+        self.line_bits = [sum(1 << int(j) for j in np.flatnonzero(q)) for q in self.quoted]
+        self.lines_of = [
+            [self.line_bits[i] for i in np.flatnonzero(self.quoted[:, j])] for j in range(self.k)
+        ]
+
+        wins = np.bincount(P.argmin(axis=1), minlength=self.k)
+        self.order = _cover_order(self.quoted, wins)
+
+        # Suppliers still undecided at each depth.
+        self.undecided = [0] * (self.k + 1)
+        for d in range(self.k - 1, -1, -1):
+            self.undecided[d] = self.undecided[d + 1] | (1 << self.order[d])
+
+        self.counts = _new_counts()
+
+    def covers(self, bits: int) -> bool:
+        return all(m & bits for m in self.line_bits)
+
+    def evaluate(self, mask: np.ndarray) -> tuple[float, np.ndarray]:
+        """Total cost and per-line supplier choice for a covering supplier set `mask`."""
+        self.counts["evaluated"] += 1
+        self.counts["tier_lookups"] += self.k
+        M = np.where(mask, self.P, np.inf)
+        choice = M.argmin(axis=1)
+        price = M[self.rows, choice]
+        tonnes = np.bincount(choice, weights=self.qtys, minlength=self.k)
+        return float(self.qtys @ price) + float(tonnes @ self.schedule.charges(tonnes)), choice
+
+    def root(self) -> tuple[int, int, np.ndarray, float]:
+        return (0, 0, np.zeros(self.k, dtype=bool), float(self.qtys @ self.P.min(axis=1)))
+
+    def branch(self, node: tuple, incumbent: float) -> tuple[list[tuple], list[tuple[float, np.ndarray]]]:
+        """
+        Bound one node against the incumbent total. Returns its children
+        (include child last, so depth-first takes it first) and the covering
+        sets costed on the way. A pruned node has no children.
+        """
+        P, qtys, rows, k = self.P, self.qtys, self.rows, self.k
+        depth, inc_bits, inc, _ = node
+
+        avail = inc.copy()
+        avail[self.order[depth:]] = True
+
+        Ma = np.where(avail, P, np.inf)
+        own_all = Ma.argmin(axis=1)
+        p_all = Ma[rows, own_all]
+
+        # Tonnes each included supplier wins whatever else is added (locked),
+        # and tonnes it could still win (reach).
+        Mi = np.where(inc, P, np.inf)
+        own_inc = Mi.argmin(axis=1)
+        p_inc = Mi[rows, own_inc]
+        has_inc = np.isfinite(p_inc)
+
+        is_locked = inc[own_all]
+        locked = np.bincount(own_all[is_locked], weights=qtys[is_locked], minlength=k)
+        reach = np.bincount(own_inc[has_inc], weights=qtys[has_inc], minlength=k)
+
+        included = np.flatnonzero(inc)
+        self.counts["tier_lookups"] += len(included)
+        lb = float(qtys @ p_all) + sum(
+            self.schedule.min_charge(float(locked[j]), float(reach[j])) for j in included
+        )
+        # Only prune what is strictly worse, so equal-cost sets are still
+        # ranked by _rank whatever order they are found in.
+        if lb > incumbent + _TOL:
+            self.counts["pruned"] += 1
+            return [], []
+        if depth == k:
+            return [], []
+
+        nxt = self.order[depth]
+        children = []
+        found = []
+
+        # Excluding nxt is only possible if every line it quotes keeps another
+        # candidate; otherwise nxt is forced in.
+        rest = inc_bits | self.undecided[depth + 1]
+        if all(m & rest for m in self.lines_of[nxt]):
+            children.append((depth + 1, inc_bits, inc, lb))
+        else:
+            self.counts["infeasible"] += 1
+
+        # Including a supplier that cannot undercut the current set on any line
+        # gives the same allocation as excluding it.
+        p_nxt = P[:, nxt]
+        undercuts = self.quoted[:, nxt] & (
+            ~has_inc | (p_nxt < p_inc) | ((p_nxt == p_inc) & (nxt < own_inc))
+        )
+        if undercuts.any():
+            inc2_bits = inc_bits | (1 << nxt)
+            inc2 = inc.copy()
+            inc2[nxt] = True
+            if self.covers(inc2_bits):
+                found.append(self.evaluate(inc2))
+            children.append((depth + 1, inc2_bits, inc2, lb))
         else:
-            mx = float(mx)
+            self.counts["redundant"] += 1
+
+        return children, found
+
+    def run(
+        self,
+        stack: list[tuple],
+        pool: _Incumbents,
+        *,
+        deadline: float | None = None,
+        node_limit: int | None = None,
+        shared=None
+    ) -> int:
+        """
+        Depth-first search from the nodes on `stack` until it is empty or the
+        budget (time.monotonic() deadline, node count) runs out; unexplored
+        nodes are left on `stack` and allocations found go into `pool`.
+        `shared` is an optional multiprocessing Value holding the pool bound
+        reached by any worker (single-incumbent searches only), used for
+        pruning. Returns the number of nodes visited.
+        """
+        nodes = 0
+        while stack:
+            if node_limit is not None and nodes >= node_limit:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+            node = stack.pop()
+            nodes += 1
+
+            incumbent = pool.bound if shared is None else min(pool.bound, shared.value)
+            children, found = self.branch(node, incumbent)
+            for res in found:
+                if pool.offer(res) and shared is not None:
+                    with shared.get_lock():
+                        if pool.bound < shared.value:
+                            shared.value = pool.bound
+            stack.extend(children)
+
+        return nodes
+
+    def lower_bound(self) -> float:
+        """
+        Bound valid for any no-split allocation, not only cheapest-in-set
+        ones. The larger of:
+          - the cheapest price per line, plus for each supplier that is the
+            only quote on some line the lowest charge it can pay between those
+            forced tonnes and all the tonnes it quotes,
+          - per line, the cheapest price plus £/t over its quoting suppliers,
+            each at the lowest rate it can charge between the line's own tonnes
+            and all the tonnes it quotes (a line's tonnes pay their
+            supplier's rate, and that supplier carries at least the line).
+        """
+        P, qtys, schedule = self.P, self.qtys, self.schedule
+        only = self.quoted.sum(axis=1) == 1
+        forced = np.bincount(P[only].argmin(axis=1), weights=qtys[only], minlength=self.k)
+        reach = qtys @ self.quoted
+        by_supplier = float(qtys @ P.min(axis=1))
+        for j in np.flatnonzero(forced > 0):
+            by_supplier += schedule.min_charge(float(forced[j]), float(reach[j]))
+
+        by_line = 0.0
+        for i, qi in enumerate(qtys):
+            cand = np.flatnonzero(self.quoted[i])
+            if qi <= 0 or not len(cand):
+                continue
+            self.counts["tier_lookups"] += len(cand)
+            by_line += float(qi) * min(
+                float(P[i, j]) + schedule.min_rate(float(qi), float(reach[j])) for j in cand
+            )
+        return max(by_supplier, by_line)
+
+    def improve(
+        self,
+        choice: np.ndarray,
+        *,
+        deadline: float | None = None,
+        max_rounds: int = 50
+    ) -> tuple[tuple[float, np.ndarray], int, bool]:
+        """
+        Local search from a per-line supplier choice, taking any move that
+        lowers the total:
+          - supplier merge: move every line of one supplier to the cheapest
+            other supplier already in use, closing its small-lot charge,
+          - line swap: move one line to another supplier (in use or not) when
+            the change in small-lot charges outweighs the price difference.
+        Stops at a local optimum, after max_rounds or at the deadline.
+        Returns ((total, choice), moves evaluated, whether it reached a local
+        optimum).
+        """
+        P, qtys, rows, k = self.P, self.qtys, self.rows, self.k
+        charges, charge_per_t = self.schedule.charges, self.schedule.charge_per_t
+
+        def cost(ch, t):
+            return float(qtys @ P[rows, ch]) + float(t @ charges(t))
+
+        def out_of_time():
+            return deadline is not None and time.monotonic() >= deadline
+
+        choice = np.array(choice, dtype=np.intp)
+        tonnes = np.bincount(choice, weights=qtys, minlength=k)
+        current = cost(choice, tonnes)
+        moves = 0
+        converged = False
+
+        for _ in range(max_rounds):
+            improved = False
+
+            used = np.flatnonzero(tonnes > 0)
+            merge = None
+            for a in used:
+                if out_of_time():
+                    break
+                others = used[used != a]
+                lines = np.flatnonzero(choice == a)
+                if not len(others) or not len(lines):
+                    continue
+                sub = P[np.ix_(lines, others)]
+                if not np.isfinite(sub.min(axis=1)).all():
+                    continue
+                trial = choice.copy()
+                trial[lines] = others[sub.argmin(axis=1)]
+                t2 = np.bincount(trial, weights=qtys, minlength=k)
+                value = cost(trial, t2)
+                moves += 1
+                if value < (merge[0] if merge else current) - _TOL:
+                    merge = (value, trial, t2)
+            if merge is not None:
+                current, choice, tonnes = merge
+                improved = True
+
+            for i in range(len(qtys)):
+                if out_of_time():
+                    break
+                a, qi = choice[i], qtys[i]
+                cand = np.flatnonzero(self.quoted[i])
+                cand = cand[cand != a]
+                if qi <= 0 or not len(cand):
+                    continue
+                t_a, t_b = float(tonnes[a]), tonnes[cand]
+                leave = (t_a - qi) * charge_per_t(t_a - qi) - t_a * charge_per_t(t_a)
+                delta = (
+                    qi * (P[i, cand] - P[i, a])
+                    + (t_b + qi) * charges(t_b + qi) - t_b * charges(t_b)
+                    + leave
+                )
+                moves += len(cand)
+                b = int(np.argmin(delta))
+                if delta[b] < -_TOL:
+                    choice[i] = cand[b]
+                    tonnes[a] -= qi
+                    tonnes[cand[b]] += qi
+                    improved = True
+
+            if out_of_time():
+                break
+            if not improved:
+                converged = True
+                break
+
+        tonnes = np.bincount(choice, weights=qtys, minlength=k)
+        return (cost(choice, tonnes), choice), moves, converged
+
+    def split(self, pool: _Incumbents, n: int) -> tuple[list[tuple], int]:
+        """
+        Expand the tree breadth-first (a prefix of the supplier order) until
+        there are at least n open subtrees. Returns (subtrees, nodes).
+        """
+        frontier = deque([self.root()])
+        nodes = 0
+        while frontier and len(frontier) < n:
+            node = frontier.popleft()
+            nodes += 1
+            children, found = self.branch(node, pool.bound)
+            for res in found:
+                pool.offer(res)
+            frontier.extend(children)
+        return list(frontier), nodes
+
+
+# Worker-process state for parallel searches (set by _init_search_worker).
+_WORKER_SEARCH: _SupplierSearch | None = None
+_WORKER_SHARED = None
+
+
+def _init_search_worker(search: _SupplierSearch, shared) -> None:
+    global _WORKER_SEARCH, _WORKER_SHARED
+    _WORKER_SEARCH = search
+    _WORKER_SHARED = shared
+
+
+def _search_subtree(task: tuple) -> tuple[_Incumbents, int, float | None, dict]:
+    """Search one subtree in a worker. Returns (pool, nodes, bound left open or None, counts)."""
+    node, pool, deadline, node_limit = task
+    _WORKER_SEARCH.counts = _new_counts()
+    stack = [node]
+    shared = _WORKER_SHARED if pool.size == 1 else None
+    nodes = _WORKER_SEARCH.run(
+        stack, pool, deadline=deadline, node_limit=node_limit, shared=shared
+    )
+    open_bound = min((entry[3] for entry in stack), default=None)
+    return pool, nodes, open_bound, _WORKER_SEARCH.counts
+
+
+def _fingerprint(
+    basket: list[dict],
+    suppliers: list[str],
+    P: np.ndarray,
+    qtys: np.ndarray,
+    schedule: TierSchedule,
+    top_k: int
+) -> str:
+    """Digest of everything an optimisation result depends on."""
+    lines = [(line["Product"], line["Location"], line["Delivery Window"]) for line in basket]
+    h = hashlib.blake2b(repr((lines, suppliers, schedule.tiers, int(top_k))).encode(), digest_size=16)
+    h.update(P.tobytes())
+    h.update(qtys.tobytes())
+    return h.hexdigest()
+
+
+def _warm_sets(previous: dict, suppliers: list[str], search: "_SupplierSearch") -> list[np.ndarray]:
+    """
+    Supplier sets to seed a re-optimisation with: the sets behind a previous
+    result (best and alternatives) mapped onto the current suppliers, with
+    lines they no longer cover (added lines, withdrawn quotes) given to their
+    cheapest supplier, plus every set one supplier away from those.
+    """
+    col = {s: j for j, s in enumerate(suppliers)}
+    sets = []
+    for prev in [previous] + list(previous.get("alternatives") or []):
+        mask = np.zeros(search.k, dtype=bool)
+        for row in prev.get("allocation") or []:
+            j = col.get(row["Supplier"])
+            if j is not None:
+                mask[j] = True
+
+        uncovered = ~(search.quoted & mask).any(axis=1)
+        mask[search.P[uncovered].argmin(axis=1)] = True
+        sets.append(mask)
+
+        for j in range(search.k):
+            nb = mask.copy()
+            nb[j] = not nb[j]
+            if search.quoted[:, nb].any(axis=1).all():
+                sets.append(nb)
+    return sets
+
+
+def _allocation_result(
+    basket: list[dict],
+    suppliers: list[str],
+    P: np.ndarray,
+    qtys: np.ndarray,
+    schedule: TierSchedule,
+    choice: np.ndarray
+) -> dict:
+    """
+    Allocation rows, per-supplier lot charges and totals for one per-line
+    supplier choice.
+    """
+    pieces = [(i, int(choice[i]), float(qtys[i])) for i in range(len(basket))]
+    return _priced_result(basket, suppliers, P, pieces, schedule)
+
+
+def _priced_result(
+    basket: list[dict],
+    suppliers: list[str],
+    P: np.ndarray,
+    pieces: list[tuple[int, int, float]],
+    schedule: TierSchedule
+) -> dict:
+    """
+    Allocation rows, per-supplier lot charges and totals for a list of
+    (line, supplier column, tonnes) pieces in line order.
+    """
+    allocation = []
+    base_cost = 0.0
+    tonnes = np.zeros(len(suppliers))
+    for i, j, qty in pieces:
+        line = basket[i]
+        price = float(P[i, j])
+        allocation.append({
+            "Product": line["Product"],
+            "Location": line["Location"],
+            "Delivery Window": line["Delivery Window"],
+            "Qty": qty,
+            "Supplier": suppliers[j],
+            "Price": price,
+            "Line Cost": qty * price
+        })
+        base_cost += qty * price
+        tonnes[j] += qty
+
+    # Tiered small-lot charges per supplier (based on tonnes allocated to that supplier)
+    lot_charge_total = 0.0
+    lot_charges = []
+
+    for j in np.flatnonzero(tonnes > 0):
+        t = float(tonnes[j])
+        cpt = schedule.charge_per_t(t)
+        if cpt > 0:
+            c = t * cpt
+            lot_charge_total += c
+            lot_charges.append({
+                "Supplier": suppliers[j],
+                "Tonnes": t,
+                "Charge £/t": cpt,
+                "Lot Charge": c
+            })
+
+    return {
+        "total": base_cost + lot_charge_total,
+        "base_cost": base_cost,
+        "lot_charge_total": lot_charge_total,
+        "allocation": allocation,
+        "lot_charges": lot_charges,
+    }
+
+
+# Most top-up suggestions returned with a result.
+TOP_UP_SUGGESTIONS = 5
+
+
+def _top_up_suggestions(
+    basket: list[dict],
+    suppliers: list[str],
+    P: np.ndarray,
+    schedule: TierSchedule,
+    tonnes: np.ndarray,
+    limit: int = TOP_UP_SUGGESTIONS
+) -> list[dict]:
+    """
+    Tonnage top-ups that lower the basket total by lifting a supplier into a
+    cheaper small-lot tier. For each supplier paying a charge, each tier that
+    starts above its tonnes is reached by adding the difference of the
+    cheapest basket line it quotes; suggestions that save money are returned
+    best first (at most `limit`, one per supplier and tier).
+    """
+    out = []
+    starts = sorted({mn for mn, _, _ in schedule.tiers})
+    for j in np.flatnonzero(tonnes > 0):
+        t = float(tonnes[j])
+        cpt = schedule.charge_per_t(t)
+        if cpt <= 0:
+            continue
+        i = int(np.argmin(P[:, j]))
+        price = float(P[i, j])
+        for x in starts:
+            if x <= t + _TIER_EPS:
+                continue
+            add = x - t
+            new_cpt = schedule.charge_per_t(x)
+            saving = t * cpt - (add * price + x * new_cpt)
+            if saving <= _TOL:
+                continue
+            line = basket[i]
+            out.append({
+                "Supplier": suppliers[j],
+                "Product": line["Product"],
+                "Location": line["Location"],
+                "Delivery Window": line["Delivery Window"],
+                "Add t": add,
+                "Price": price,
+                "Tonnes": t,
+                "New Tonnes": x,
+                "Charge £/t": cpt,
+                "New Charge £/t": new_cpt,
+                "Saving": saving,
+            })
+    out.sort(key=lambda r: -r["Saving"])
+    return out[:limit]
 
-        if (t + eps) >= mn and (mx is None or (t - eps) <= mx):
-            return float(r["charge_per_t"])
 
-    # If not covered by tiers, default to no charge
-    return 0.0
+# engine="auto" switches to the heuristic above this many suppliers.
+HEURISTIC_SUPPLIERS = 25
 
 
 def optimise_basket(
-    supplier_prices: pd.DataFrame,
+    supplier_prices: pd.DataFrame | PriceIndex,
     basket: list[dict],
-    tiers: pd.DataFrame
+    tiers: TierSchedule | pd.DataFrame,
+    *,
+    time_limit: float | None = None,
+    node_limit: int | None = None,
+    workers: int | None = None,
+    top_k: int = 1,
+    warm_start: dict | None = None,
+    stats: bool = False,
+    engine: str = "exact"
 ) -> dict:
     """
     Optimise a basket subject to:
@@ -51,6 +974,62 @@ def optimise_basket(
       - Tiered small-lot charges applied PER SUPPLIER based on total tonnes allocated
         to that supplier in the basket.
 
+    The search works on supplier sets: for a chosen set every line goes to the
+    cheapest supplier in the set (ties broken by supplier name). Duplicate and
+    dominated suppliers are dropped first (see _dominated_suppliers), then the
+    best set is found by a branch-and-bound over include/exclude decisions per
+    supplier:
+      - lower bound = cheapest price per line over the suppliers still available
+        + the lowest tier charge each included supplier can reach given the
+        tonnes it is certain to win and the tonnes it could still win,
+      - branches whose bound cannot beat the incumbent are pruned,
+      - the search is exhaustive otherwise (there is no cap on the number of
+        suppliers), so the best cheapest-in-set allocation is found.
+
+    Cheapest-in-set allocations are not the whole problem: moving a line to a
+    dearer supplier in the set can pay for itself by lifting that supplier into
+    a cheaper tier. The best allocation found is therefore polished with line
+    moves (see _SupplierSearch.improve) before it is returned. The result is
+    only reported optimal when its total meets _SupplierSearch.lower_bound,
+    which holds for every no-split allocation; otherwise gap is measured
+    against that bound and may overstate the true gap.
+
+    The search is anytime: with time_limit (seconds) or node_limit it stops
+    when the budget runs out and returns the best allocation found so far.
+    The all-suppliers set (cheapest price per line) is costed up front, so
+    there is always an answer.
+
+    With workers > 1 the tree is expanded breadth-first over a prefix of the
+    supplier order and the open subtrees are searched on a process pool. Workers
+    share the best total found so far for pruning; ties between equal-cost sets
+    are broken the same way as in the serial search, so a completed parallel
+    run returns exactly the serial result.
+
+    With top_k > 1 the same search also keeps the K best distinct allocations
+    (pruning against the K-th best instead of the best) and returns the
+    runners-up as ranked alternatives, so no extra solves are needed. The
+    alternatives are drawn from the suppliers left after the pre-pass: an
+    allocation using a dropped supplier always has a no-dearer counterpart
+    without it.
+
+    warm_start takes the previous result for the same book (e.g. after a line
+    was added, removed or changed). If nothing it depends on has changed it is
+    returned as is; otherwise the supplier sets it used, repaired for the new
+    basket, and their one-supplier neighbours are costed first. This is not an
+    incremental re-solve: the whole tree is still searched, but from a tight
+    incumbent, so branches the cold search would only prune once it had found
+    a comparable allocation are pruned on first visit.
+
+    engine="heuristic" replaces the branch-and-bound with the same local
+    search (see _SupplierSearch.improve) run from the cheapest supplier per
+    line, for supplier universes too large to search exactly. Both engines
+    solve the same problem (any no-split allocation) and report it the same
+    way: lower_bound is _SupplierSearch.lower_bound, optimal means the total
+    meets it, and complete means the engine's own search (the tree, or the
+    local search reaching a local optimum) finished within the budget.
+    engine="auto" picks the heuristic when more than HEURISTIC_SUPPLIERS
+    suppliers remain after the pre-pass.
+
     Inputs:
       supplier_prices columns (case-sensitive as passed in):
         - Supplier
@@ -58,6 +1037,7 @@ def optimise_basket(
         - Location
         - Delivery Window
         - Price
+        (or a PriceIndex built from such a frame)
 
       basket: list of dicts with keys:
         - Product
@@ -65,11 +1045,17 @@ def optimise_basket(
         - Delivery Window
         - Qty
 
-      tiers columns:
-        - min_t
-        - max_t (nullable)
-        - charge_per_t
-        - active (bool or int)
+      tiers: TierSchedule (build once with TierSchedule.from_frame); a raw
+        small_lot_tiers frame is compiled on the fly.
+
+      time_limit: optional search budget in seconds.
+      node_limit: optional search budget in nodes (split evenly across
+        subtrees in parallel mode).
+      workers: optional number of worker processes for the search.
+      top_k: number of ranked allocations to keep (1 = best only).
+      warm_start: optional previous optimise_basket result to start from.
+      stats: include the stats block in the result.
+      engine: "exact" (default), "heuristic" or "auto".
 
     Output:
       dict with:
@@ -80,115 +1066,759 @@ def optimise_basket(
         base_cost: float
         lot_charge_total: float
         total: float
+        complete: bool (the engine's search finished within the budget)
+        optimal: bool (total meets lower_bound, so no no-split allocation
+          is cheaper)
+        lower_bound: float (proven lower bound on any no-split allocation)
+        gap: float (total - lower_bound, £)
+        gap_pct: float (gap as % of total)
+        nodes: int (search nodes visited; moves evaluated for the heuristic)
+        pruned_suppliers: int (duplicate or dominated suppliers dropped before the search)
+        alternatives: list[dict] (ranks 2..top_k, each with rank, suppliers,
+          allocation, lot_charges, base_cost, lot_charge_total, total and
+          delta vs the best total)
+        fingerprint: str (digest of the inputs, used to recognise a warm start
+          that can be reused unchanged)
+        stats: dict (only with stats=True; see _search_stats)
+        engine: str ("exact" or "heuristic", the engine actually used)
+        top_ups: list[dict] (tier top-ups that would lower the total; see
+          _top_up_suggestions)
+
+    The stats are also logged (at INFO when the search is slow, DEBUG
+    otherwise) and passed to the hook registered with set_stats_hook.
     """
+    t_start = time.perf_counter()
     if not basket:
         return {"ok": False, "error": "Basket is empty."}
+    if engine not in ("exact", "heuristic", "auto"):
+        return {"ok": False, "error": f"Unknown optimiser engine: {engine}"}
 
-    required_sp = {"Supplier", "Product", "Location", "Delivery Window", "Price"}
-    missing_sp = required_sp - set(supplier_prices.columns)
-    if missing_sp:
-        return {"ok": False, "error": f"supplier_prices missing columns: {sorted(missing_sp)}"}
+    built = _basket_matrix(supplier_prices, basket)
+    if isinstance(built, str):
+        return {"ok": False, "error": built}
+    all_suppliers, P, qtys = built
 
-    # Build per-line candidate suppliers
-    candidates_by_line: list[tuple[dict, pd.DataFrame]] = []
-    all_suppliers: set[str] = set()
+    k = len(all_suppliers)
+    if k == 0:
+        return {"ok": False, "error": "No suppliers available for this basket."}
+    t_built = time.perf_counter()
 
-    for line in basket:
-        prod = line["Product"]
-        loc = line["Location"]
-        win = line["Delivery Window"]
+    schedule = tiers if isinstance(tiers, TierSchedule) else TierSchedule.from_frame(tiers)
 
-        subset = supplier_prices[
-            (supplier_prices["Product"] == prod) &
-            (supplier_prices["Location"] == loc) &
-            (supplier_prices["Delivery Window"] == win)
-        ][["Supplier", "Price"]].copy()
+    fingerprint = _fingerprint(basket, all_suppliers, P, qtys, schedule, top_k)
+    if (
+        warm_start
+        and warm_start.get("ok")
+        and warm_start.get("complete")
+        and warm_start.get("fingerprint") == fingerprint
+    ):
+        return warm_start
 
-        if subset.empty:
-            return {"ok": False, "error": f"No supplier prices for {prod} @ {loc} {win}"}
+    drop = _dominated_suppliers(P, qtys, schedule)
+    pruned_suppliers = int(drop.sum())
+    if pruned_suppliers:
+        all_suppliers = [s for s, d in zip(all_suppliers, drop) if not d]
+        P = P[:, ~drop]
+        k = len(all_suppliers)
 
-        subset = subset.sort_values("Price", ascending=True)
-        candidates_by_line.append((line, subset))
-        all_suppliers.update(subset["Supplier"].tolist())
+    if engine == "auto":
+        engine = "heuristic" if k > HEURISTIC_SUPPLIERS else "exact"
 
-    all_suppliers = sorted(all_suppliers)
-    k = len(all_suppliers)
+    search = _SupplierSearch(P, qtys, schedule)
+    t_search = time.perf_counter()
+
+    deadline = None if time_limit is None else time.monotonic() + float(time_limit)
+
+    pool = _Incumbents(top_k)
+    pool.offer(search.evaluate(np.ones(k, dtype=bool)))
+    if warm_start and warm_start.get("ok"):
+        for mask in _warm_sets(warm_start, all_suppliers, search):
+            pool.offer(search.evaluate(mask))
+
+    if engine == "heuristic":
+        res, nodes, converged = search.improve(pool.best[1], deadline=deadline)
+        pool.offer(res)
+        bound = min(search.lower_bound(), pool.best[0])
+        open_bounds = [] if converged else [bound]
+    elif workers is not None and workers > 1:
+        subtrees, nodes = search.split(pool, 4 * workers)
+        open_bounds = []
+        if subtrees:
+            per_tree = None if node_limit is None else max((node_limit - nodes) // len(subtrees), 1)
+            shared = multiprocessing.Value("d", pool.bound)
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_search_worker,
+                initargs=(search, shared)
+            ) as executor:
+                tasks = [(node, pool, deadline, per_tree) for node in subtrees]
+                for sub_pool, sub_nodes, open_bound, sub_counts in executor.map(_search_subtree, tasks):
+                    nodes += sub_nodes
+                    for name, n in sub_counts.items():
+                        search.counts[name] += n
+                    for res in sub_pool.ranked():
+                        pool.offer(res)
+                    if open_bound is not None:
+                        open_bounds.append(open_bound)
+    else:
+        stack = [search.root()]
+        nodes = search.run(stack, pool, deadline=deadline, node_limit=node_limit)
+        open_bounds = [entry[3] for entry in stack]
+
+    if engine == "exact":
+        # Runs to a local optimum whatever the budget: it is cheap next to the
+        # search and the only step that leaves cheapest-in-set allocations.
+        res, _, _ = search.improve(pool.best[1])
+        pool.offer(res)
+        bound = min(search.lower_bound(), pool.best[0])
+
+    complete = not open_bounds
+    lower_bound = bound
+    t_searched = time.perf_counter()
+
+    ranked = [
+        _allocation_result(basket, all_suppliers, P, qtys, schedule, choice)
+        for _, choice in pool.ranked()
+    ]
+    best = ranked[0]
+    total = best["total"]
+    gap = max(total - lower_bound, 0.0)
+
+    alternatives = []
+    for rank, alt in enumerate(ranked[1:], start=2):
+        alternatives.append({
+            "rank": rank,
+            "suppliers": sorted({a["Supplier"] for a in alt["allocation"]}),
+            **alt,
+            "delta": alt["total"] - total,
+        })
+
+    result = {
+        "ok": True,
+        **best,
+        "complete": complete,
+        "optimal": gap <= _TOL,
+        "lower_bound": lower_bound,
+        "gap": gap,
+        "gap_pct": gap / total * 100.0 if total else 0.0,
+        "nodes": nodes,
+        "pruned_suppliers": pruned_suppliers,
+        "alternatives": alternatives,
+        "fingerprint": fingerprint,
+        "engine": engine,
+        "top_ups": _top_up_suggestions(
+            basket, all_suppliers, P, schedule,
+            np.bincount(pool.best[1], weights=qtys, minlength=k)
+        ),
+    }
+
+    block = _search_stats(
+        search,
+        nodes=nodes,
+        lines=len(basket),
+        suppliers=len(all_suppliers) + pruned_suppliers,
+        complete=complete,
+        build_ms=(t_built - t_start) * 1000.0,
+        prepass_ms=(t_search - t_built) * 1000.0,
+        search_ms=(t_searched - t_search) * 1000.0,
+        total_ms=(time.perf_counter() - t_start) * 1000.0,
+    )
+    _report_stats(block)
+    if stats:
+        result["stats"] = block
+    return result
+
+
+# Split mode. Per-tonne penalty on flow that bypasses a supplier's band
+# minimum: far above any price difference, so minimums are filled first.
+_BAND_PENALTY = 1e6
+
+
+def _tier_bands(schedule: TierSchedule) -> list[tuple[float, float, float]]:
+    """
+    Tonnage bands (lo, hi, charge £/t) a supplier can be held to in split
+    mode: band 0 is "not used", then one band per tier in lookup order, then
+    the range below the first tier.
+    """
+    bands = [(0.0, 0.0, 0.0)]
+    for mn, mx, cpt in schedule.tiers:
+        bands.append((mn, np.inf if mx is None else mx, cpt))
+    first = min((mn for mn, _, _ in schedule.tiers), default=np.inf)
+    if first > 0:
+        bands.append((0.0, first, float(schedule.below)))
+    return bands
+
+
+def _band_of(bands: list[tuple[float, float, float]], t: float) -> int:
+    """Band holding tonnage t (the closest band below it for tonnages in a tier gap)."""
+    if t <= FLOW_EPS:
+        return 0
+    for b, (lo, hi, _) in enumerate(bands[1:], start=1):
+        if lo - _TIER_EPS <= t <= hi + _TIER_EPS:
+            return b
+    return max(range(1, len(bands)), key=lambda b: (bands[b][0] <= t, bands[b][0]))
+
+
+def _split_flow(P: np.ndarray, qtys: np.ndarray, bands: list, assign: list[int]) -> np.ndarray | None:
+    """
+    Cheapest split allocation (lines x suppliers tonnes) with supplier j's total
+    held inside bands[assign[j]], paying the band's £/t on top of the price:
+
+        source -> line i (cap qty_i) -> supplier j (price) -> sink
+        supplier j -> sink: band minimum at the band charge, the rest of the
+        band at the band charge + _BAND_PENALTY
+
+    Line -> supplier arcs cost the price less the line's cheapest quote, so
+    they are non-negative whatever the prices (MinCostFlow needs that). Every
+    tonne of a line crosses exactly one of them, so this lowers every
+    allocation's cost by the same constant and leaves the optimum unchanged.
+
+    Returns None if the bands cannot all be met.
+    """
+    n, k = P.shape
+    total = float(qtys.sum())
+    lo = np.array([bands[b][0] for b in assign])
+    if lo.sum() > total + FLOW_EPS:
+        return None
+
+    floor = np.where(np.isfinite(P), P, np.inf).min(axis=1)
+    source, sink = 0, n + k + 1
+    net = MinCostFlow(n + k + 2)
+    line_arcs = []
+    for i in range(n):
+        net.add_arc(source, 1 + i, qtys[i], 0.0)
+        for j in np.flatnonzero(np.isfinite(P[i])):
+            if assign[j]:
+                line_arcs.append((i, j, net.add_arc(1 + i, 1 + n + j, qtys[i], P[i, j] - floor[i])))
+
+    min_arcs = []
+    for j in range(k):
+        if not assign[j]:
+            continue
+        b_lo, b_hi, cpt = bands[assign[j]]
+        if b_lo > 0:
+            min_arcs.append((b_lo, net.add_arc(1 + n + j, sink, b_lo, cpt)))
+        if min(b_hi, total) > b_lo:
+            net.add_arc(1 + n + j, sink, min(b_hi, total) - b_lo, cpt + _BAND_PENALTY)
+
+    sent, _ = net.solve(source, sink, total)
+    if sent < total - FLOW_EPS or any(net.flow_on(a) < m - FLOW_EPS for m, a in min_arcs):
+        return None
+
+    X = np.zeros((n, k))
+    for i, j, a in line_arcs:
+        X[i, j] = net.flow_on(a)
+    return X
+
+
+def _fill_bands(P: np.ndarray, qtys: np.ndarray, bands: list, assign: list[int]) -> np.ndarray | None:
+    """
+    Quick split allocation (lines x suppliers tonnes) for a band assignment:
+    every line whole to its cheapest supplier at price + band charge, then
+    each supplier short of its band minimum takes the cheapest extra tonnage
+    from the others and each supplier over its band maximum gives the
+    cheapest tonnage away. If no supplier is short or over this is the
+    _split_flow optimum; otherwise it is an upper bound on it, and suppliers
+    it takes tonnage from may leave their bands. None if some line has no
+    supplier in use.
+    """
+    n, k = P.shape
+    on = np.asarray(assign) > 0
+    lo = np.array([bands[b][0] for b in assign])
+    hi = np.array([bands[b][1] for b in assign])
+    C = np.where(on, P + np.array([bands[b][2] for b in assign]), np.inf)
+    choice = C.argmin(axis=1)
+    rows = np.arange(n)
+    if not np.isfinite(C[rows, choice]).all():
+        return None
+
+    X = np.zeros((n, k))
+    X[rows, choice] = qtys
+    tonnes = X.sum(axis=0)
+
+    for j in np.flatnonzero(on & ((tonnes < lo - FLOW_EPS) | (tonnes > hi + FLOW_EPS))):
+        if tonnes[j] < lo[j]:
+            # (line, current holder) pieces j could take over, cheapest first.
+            i, o = np.nonzero((X > FLOW_EPS) & np.isfinite(C[:, [j]]))
+            keep = o != j
+            i, o = i[keep], o[keep]
+            delta = C[i, j] - C[i, o]
+            src, dst, need = o, np.full(len(i), j), lo[j] - tonnes[j]
+        else:
+            # (line, new holder) moves for j's pieces, cheapest first.
+            i, d = np.nonzero((X[:, [j]] > FLOW_EPS) & np.isfinite(C))
+            keep = d != j
+            i, d = i[keep], d[keep]
+            delta = C[i, d] - C[i, j]
+            src, dst, need = np.full(len(i), j), d, tonnes[j] - hi[j]
+        for m in np.argsort(delta, kind="stable"):
+            if need <= FLOW_EPS:
+                break
+            x = min(X[i[m], src[m]], need)
+            if x <= FLOW_EPS:
+                continue
+            X[i[m], src[m]] -= x
+            X[i[m], dst[m]] += x
+            tonnes[src[m]] -= x
+            tonnes[dst[m]] += x
+            need -= x
+    return X
+
+
+def _band_bound(P: np.ndarray, qtys: np.ndarray, bands: list, assign: list[int]) -> float:
+    """
+    Lower bound on the _split_flow cost for a band assignment: every line at
+    its cheapest price + band charge, plus the least it can cost to meet the
+    band limits. A supplier short of its minimum needs the shortfall from
+    lines where it is not cheapest, each tonne costing at least its smallest
+    price gap there; a supplier over its maximum must hand the excess on at
+    the smallest gap to a line's next cheapest supplier. The two can share
+    moves, so only the larger is added. inf if the bands cannot be met.
+    """
+    n, k = P.shape
+    on = np.asarray(assign) > 0
+    lo = np.array([bands[b][0] for b in assign])
+    hi = np.array([bands[b][1] for b in assign])
+    C = np.where(on, P + np.array([bands[b][2] for b in assign]), np.inf)
+    cheapest = C.min(axis=1)
+    if not np.isfinite(cheapest).all():
+        return np.inf
+    gap = C - cheapest[:, None]
+    tight = gap <= _TOL
+
+    short = np.where(on, np.clip(lo - qtys @ tight, 0.0, None), 0.0)
+    step = np.where(tight, np.inf, gap).min(axis=0)
+    if (np.isinf(step) & (short > FLOW_EPS)).any():
+        return np.inf
+    shortfall = float(short[short > FLOW_EPS] @ step[short > FLOW_EPS])
+
+    owner = C.argmin(axis=1)
+    sole = tight.sum(axis=1) == 1
+    held = np.bincount(owner[sole], weights=qtys[sole], minlength=k)
+    runner_up = np.sort(gap, axis=1)[:, 1] if k > 1 else np.full(n, np.inf)
+    excess = 0.0
+    for j in np.flatnonzero(on & (held > hi + FLOW_EPS)):
+        excess += (held[j] - hi[j]) * float(runner_up[sole & (owner == j)].min())
+
+    return float(qtys @ cheapest) + max(shortfall, excess)
+
+
+def _split_pieces(P: np.ndarray, X: np.ndarray, min_split: float) -> list[tuple[int, int, float]]:
+    """
+    (line, supplier, tonnes) pieces from a split allocation. Pieces of a split
+    line below min_split are folded into that line's largest piece.
+    """
+    pieces = []
+    for i in range(X.shape[0]):
+        js = np.flatnonzero(X[i] > FLOW_EPS)
+        if len(js) == 0:
+            pieces.append((i, int(np.argmin(P[i])), float(X[i].sum())))
+            continue
+        if len(js) > 1 and min_split > 0:
+            largest = js[np.argmax(X[i, js])]
+            keep = [j for j in js if j == largest or X[i, j] >= min_split - FLOW_EPS]
+            X[i, largest] += sum(X[i, j] for j in js if j not in keep)
+            js = keep
+        pieces.extend((i, int(j), float(X[i, j])) for j in js)
+    return pieces
+
+
+def optimise_basket_split(
+    supplier_prices: pd.DataFrame | PriceIndex,
+    basket: list[dict],
+    tiers: TierSchedule | pd.DataFrame,
+    *,
+    min_split: float = 0.0,
+    time_limit: float | None = None,
+    warm_start: dict | None = None
+) -> dict:
+    """
+    Optimise a basket allowing lines to be split across suppliers (each piece
+    at least min_split tonnes), with the tiered small-lot charge applied per
+    supplier to the tonnes it is allocated.
+
+    With each supplier held to one tier band the problem is a min-cost flow
+    (see _split_flow), solved in polynomial time. Bands are chosen by local
+    search, starting from a no-split allocation: the cheapest supplier per
+    line, improved by the heuristic engine's line moves and supplier merges
+    (_SupplierSearch.improve), so the result is never dearer than that
+    allocation; and from warm_start, if given. The exponential supplier-set
+    search is not run, so the result can be dearer than an exact
+    optimise_basket answer. Moves put one supplier in another band (or in or
+    out of use) and are tried first improvement in two passes:
+      - quick: the move is costed by _fill_bands, which tops suppliers up to
+        their band minimum from the others (moving those across bands too);
+        if that wins, every supplier is re-banded where its tonnes landed
+        and the flow solved for that assignment,
+      - exact: once no quick move wins, each move is solved as a flow,
+        skipping moves whose _band_bound cannot beat the current total.
+    No supplier subsets are enumerated. The tier charge is not convex, so the
+    result is a local optimum; lower_bound is the cheapest price per line
+    with no charges.
+
+    Inputs are as for optimise_basket. time_limit bounds the whole call: the
+    no-split seed gets half of it and the band search the rest.
+
+    Output:
+      the optimise_basket keys (allocation may hold several rows per line;
+      alternatives is empty), plus:
+        split: True
+        min_split: float
+        nodes: int (flows solved)
+        complete: bool (band search converged within the budget)
+    """
+    if not basket:
+        return {"ok": False, "error": "Basket is empty."}
+
+    built = _basket_matrix(supplier_prices, basket)
+    if isinstance(built, str):
+        return {"ok": False, "error": built}
+    suppliers, P, qtys = built
+    k = len(suppliers)
     if k == 0:
         return {"ok": False, "error": "No suppliers available for this basket."}
 
-    best = None
+    schedule = tiers if isinstance(tiers, TierSchedule) else TierSchedule.from_frame(tiers)
+    bands = _tier_bands(schedule)
+    quoted = np.isfinite(P)
+    deadline = None if time_limit is None else time.monotonic() + float(time_limit)
 
-    # Enumerate subsets of suppliers.
-    # For MVP, cap subset size at 15 to avoid combinatorial blow-ups.
-    # If supplier universe grows, prune suppliers per line instead.
-    for r in range(1, min(k, 15) + 1):
-        for S in combinations(all_suppliers, r):
-            S = set(S)
+    seeded = None if time_limit is None else time.monotonic() + float(time_limit) / 2.0
+    (_, choice), _, _ = _SupplierSearch(P, qtys, schedule).improve(P.argmin(axis=1), deadline=seeded)
 
-            allocation = []
-            tonnes_by_supplier = {s: 0.0 for s in S}
-            base_cost = 0.0
+    col = {s: j for j, s in enumerate(suppliers)}
 
-            feasible = True
-            for line, subset in candidates_by_line:
-                sub2 = subset[subset["Supplier"].isin(S)]
-                if sub2.empty:
-                    feasible = False
-                    break
+    def supplier_tonnes(allocation):
+        tonnes = np.zeros(k)
+        for row in allocation:
+            j = col.get(row["Supplier"])
+            if j is not None:
+                tonnes[j] += float(row["Qty"])
+        return tonnes
+
+    flows = 0
+    solved = {}
+    Pz = np.where(quoted, P, 0.0)
+
+    def settle(X):
+        """Exact result for a split allocation and the dearest price paid per line."""
+        pieces = _split_pieces(P, X, min_split)
+        paid = np.zeros(len(basket))
+        for i, j, _ in pieces:
+            paid[i] = max(paid[i], P[i, j])
+        return _priced_result(basket, suppliers, P, pieces, schedule), paid
+
+    def solve(assign):
+        """settle() of the flow optimum for a band assignment, or None."""
+        nonlocal flows
+        key = tuple(assign)
+        if key not in solved:
+            flows += 1
+            X = _split_flow(P, qtys, bands, assign)
+            solved[key] = None if X is None else settle(X)
+        return solved[key]
 
-                chosen = sub2.iloc[0]
-                s = str(chosen["Supplier"])
-                price = float(chosen["Price"])
-                qty = float(line["Qty"])
-
-                allocation.append({
-                    "Product": line["Product"],
-                    "Location": line["Location"],
-                    "Delivery Window": line["Delivery Window"],
-                    "Qty": qty,
-                    "Supplier": s,
-                    "Price": price,
-                    "Line Cost": qty * price
-                })
-
-                tonnes_by_supplier[s] += qty
-                base_cost += qty * price
-
-            if not feasible:
+    def attempt(trial):
+        """
+        (priced, assignment) if a band assignment beats the best total, else
+        None. The quick allocation is costed first; if it wins, every supplier
+        is held to the band its tonnes landed in and the flow rebalances.
+        """
+        X = _fill_bands(P, qtys, bands, trial)
+        if X is None:
+            return None
+        tonnes = X.sum(axis=0)
+        if float((X * Pz).sum()) + float(tonnes @ schedule.charges(tonnes)) >= best["total"] - _TOL:
+            return None
+        found, banded = settle(X), [_band_of(bands, float(t)) for t in tonnes]
+        polished = solve(banded)
+        if polished is not None and polished[0]["total"] < found[0]["total"]:
+            found = polished
+        return (found, banded) if found[0]["total"] < best["total"] - _TOL else None
+
+    best = _allocation_result(basket, suppliers, P, qtys, schedule, choice)
+    paid = P[np.arange(len(basket)), choice]
+    assign = [_band_of(bands, float(t)) for t in np.bincount(choice, weights=qtys, minlength=k)]
+    polished = solve(assign)
+    if polished is not None and polished[0]["total"] < best["total"] - _TOL:
+        best, paid = polished
+    if warm_start and warm_start.get("ok"):
+        tonnes = supplier_tonnes(warm_start.get("allocation") or [])
+        found = attempt([_band_of(bands, float(t)) for t in tonnes])
+        if found is not None:
+            (best, paid), assign = found
+
+    # Supplier j can only reach bands up to the tonnes it quotes.
+    reach = np.where(quoted, qtys[:, None], 0.0).sum(axis=0)
+
+    def moves():
+        """Band moves from the current assignment. A supplier not in use is
+        only brought in if it undercuts a price paid."""
+        for j in range(k):
+            if not assign[j] and not (P[:, j] < paid).any():
                 continue
+            for b in range(len(bands)):
+                if b != assign[j] and bands[b][0] <= reach[j] + FLOW_EPS:
+                    trial = list(assign)
+                    trial[j] = b
+                    yield trial
 
-            # Tiered small-lot charges per supplier (based on tonnes allocated to that supplier)
-            lot_charge_total = 0.0
-            lot_charges = []
+    def out_of_time():
+        return deadline is not None and time.monotonic() >= deadline
 
-            for s, t in tonnes_by_supplier.items():
-                if t <= 0:
+    # Local search, first improvement: band moves costed by their quick
+    # allocation until none wins, then by the exact flow.
+    exact = False
+    timed_out = False
+    while True:
+        found = None
+        for trial in moves():
+            if out_of_time():
+                timed_out = True
+                break
+            if exact:
+                if _band_bound(P, qtys, bands, trial) >= best["total"] - _TOL:
                     continue
+                priced = solve(trial)
+                if priced is not None and priced[0]["total"] < best["total"] - _TOL:
+                    found = (priced, trial)
+            else:
+                found = attempt(trial)
+            if found is not None:
+                break
+        if timed_out:
+            break
+        if found is not None:
+            (best, paid), assign = found
+            exact = False
+        elif exact:
+            break
+        else:
+            exact = True
+    complete = not timed_out
+
+    tonnes = supplier_tonnes(best["allocation"])
+    total = best["total"]
+    lower_bound = float(qtys @ P.min(axis=1))
+    gap = max(total - lower_bound, 0.0)
+    return {
+        "ok": True,
+        **best,
+        "complete": complete,
+        "optimal": gap <= _TOL,
+        "lower_bound": lower_bound,
+        "gap": gap,
+        "gap_pct": gap / total * 100.0 if total else 0.0,
+        "nodes": flows,
+        "pruned_suppliers": 0,
+        "alternatives": [],
+        "split": True,
+        "min_split": float(min_split),
+        "top_ups": _top_up_suggestions(basket, suppliers, P, schedule, tonnes),
+    }
+
+
+# Searches slower than this are logged at INFO rather than DEBUG.
+SLOW_SEARCH_MS = 250.0
+
+_STATS_HOOK = None
+
+
+def set_stats_hook(hook) -> None:
+    """
+    Register a callable that receives the stats dict of every optimise_basket
+    run (e.g. to push to a metrics backend). Pass None to remove it.
+    """
+    global _STATS_HOOK
+    _STATS_HOOK = hook
+
+
+def _search_stats(search: _SupplierSearch, *, nodes: int, lines: int, suppliers: int, complete: bool, **timings) -> dict:
+    """
+    Stats block for one optimisation:
+      build_ms, prepass_ms, search_ms, total_ms: time per phase (building the
+        cost matrix; tier compile, fingerprint and dominance pre-pass;
+        branch-and-bound; everything including the result)
+      lines: basket lines
+      suppliers_quoting: suppliers quoting any basket line
+      suppliers: supplier universe searched (after the pre-pass)
+      nodes: subsets enumerated (search nodes visited)
+      evaluated: covering supplier sets costed
+      pruned: nodes cut by the lower bound
+      infeasible: exclude branches skipped because a line would lose its last quote
+      redundant: include branches skipped because the supplier undercuts nothing
+      tier_lookups: tier schedule queries made by the search
+      complete: search finished within the budget
+    """
+    return {
+        **{name: round(ms, 3) for name, ms in timings.items()},
+        "lines": lines,
+        "suppliers_quoting": suppliers,
+        "suppliers": search.k,
+        "nodes": nodes,
+        **search.counts,
+        "complete": complete,
+    }
+
+
+def _report_stats(block: dict) -> None:
+    level = logging.INFO if block["search_ms"] >= SLOW_SEARCH_MS else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, "optimise_basket %s", " ".join(f"{k}={v}" for k, v in block.items()))
+    if _STATS_HOOK is not None:
+        try:
+            _STATS_HOOK(block)
+        except Exception:
+            logger.exception("optimise_basket stats hook failed")
+
+
+_BATCH_INDEX = None
+_BATCH_SCHEDULE = None
+
+
+def _init_batch_worker(index: PriceIndex, schedule: TierSchedule):
+    global _BATCH_INDEX, _BATCH_SCHEDULE
+    _BATCH_INDEX = index
+    _BATCH_SCHEDULE = schedule
+
+
+def _optimise_batch_item(task: tuple) -> dict:
+    basket, kwargs = task
+    return optimise_basket(_BATCH_INDEX, basket, _BATCH_SCHEDULE, **kwargs)
+
+
+def optimise_baskets(
+    snapshot: pd.DataFrame | PriceIndex,
+    baskets: Iterable[list[dict]],
+    tiers: TierSchedule | pd.DataFrame,
+    *,
+    workers: int | None = None,
+    **kwargs
+) -> Iterator[dict]:
+    """
+    Optimise many baskets against one snapshot of (sell) prices.
+
+    The price index and tier schedule are built once and shared by every
+    basket. Results are yielded in basket order as they complete; with
+    workers > 1 baskets are spread over that many worker processes (each
+    basket's own search stays serial). Other optimise_basket keyword
+    arguments are passed through to every call.
+    """
+    index = snapshot if isinstance(snapshot, PriceIndex) else PriceIndex(snapshot)
+    schedule = tiers if isinstance(tiers, TierSchedule) else TierSchedule.from_frame(tiers)
+
+    if workers is None or workers <= 1:
+        for basket in baskets:
+            yield optimise_basket(index, basket, schedule, **kwargs)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_batch_worker,
+        initargs=(index, schedule)
+    ) as executor:
+        tasks = ((basket, kwargs) for basket in baskets)
+        yield from executor.map(_optimise_batch_item, tasks)
+
+
+def canonical_basket(basket: list[dict]) -> tuple:
+    """Order-independent key for a basket: its (product, location, window, qty) lines, sorted."""
+    return tuple(sorted(
+        (str(line["Product"]), str(line["Location"]), str(line["Delivery Window"]), float(line["Qty"]))
+        for line in basket
+    ))
+
+
+class ResultCache:
+    """
+    Process-wide LRU of optimise_basket results, shared by every session.
+
+    Keys are (snapshot id, margins version, tiers, canonical basket, top_k,
+    engine), so publishing a snapshot or changing a margin or tier simply
+    misses. Holds at most max_entries results; the least recently used is
+    evicted first.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            res = self._items.get(key)
+            if res is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return res
+
+    def put(self, key, res: dict):
+        with self._lock:
+            self._items[key] = res
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+RESULT_CACHE = ResultCache()
+
+
+def optimise_basket_cached(
+    snapshot_id: str,
+    margins_version: str,
+    supplier_prices: pd.DataFrame,
+    basket: list[dict],
+    tiers: TierSchedule | pd.DataFrame,
+    **kwargs
+) -> dict:
+    """
+    optimise_basket behind RESULT_CACHE. supplier_prices must be the sell
+    prices for snapshot_id under margins_version; other keyword arguments
+    are passed through. Only completed searches are cached: a failed or
+    budget-limited result is returned but not stored, so the next call
+    searches again (from warm_start, if given) rather than replaying it.
+    A completed result is optimal whatever budget or warm start produced
+    it, so those arguments are not part of the key.
+
+    A hit may come from a basket with the same lines in a different order;
+    allocation rows are then in that basket's order.
+    """
+    schedule = tiers if isinstance(tiers, TierSchedule) else TierSchedule.from_frame(tiers)
+    key = (
+        snapshot_id,
+        margins_version,
+        tuple(schedule.tiers),
+        canonical_basket(basket),
+        int(kwargs.get("top_k", 1)),
+        kwargs.get("engine", "exact"),
+    )
 
-                cpt = tier_charge_per_t(t, tiers)
-                if cpt > 0:
-                    c = t * cpt
-                    lot_charge_total += c
-                    lot_charges.append({
-                        "Supplier": s,
-                        "Tonnes": t,
-                        "Charge £/t": cpt,
-                        "Lot Charge": c
-                    })
-
-            total = base_cost + lot_charge_total
-
-            if best is None or total < best["total"]:
-                best = {
-                    "total": total,
-                    "base_cost": base_cost,
-                    "lot_charge_total": lot_charge_total,
-                    "allocation": allocation,
-                    "lot_charges": lot_charges
-                }
-
-    if best is None:
-        return {"ok": False, "error": "No feasible supplier set found."}
-
-    return {"ok": True, **best}
+    res = RESULT_CACHE.get(key)
+    if res is not None:
+        return res
 
+    res = optimise_basket(supplier_prices, basket, schedule, **kwargs)
+    if res.get("ok") and res.get("complete"):
+        RESULT_CACHE.put(key, res)
+    return res
@@ -1,6 +1,16 @@
+from collections.abc import Callable
+
 import pandas as pd
 
+from src.snapshot import SnapshotCache, compact_prices, frame_nbytes, is_coded, map_codes
+
 def apply_margins(prices: pd.DataFrame, margins: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reference implementation of sell prices (Price + margin). The app reads
+    them materialised from the db (see db._reprice), which follows the same
+    rules; tests/test_db.py checks that SQL and the best-price board
+    against this.
+    """
     df = prices.copy()
 
     if "Product Category" not in df.columns:
@@ -13,11 +23,75 @@ def apply_margins(prices: pd.DataFrame, margins: pd.DataFrame) -> pd.DataFrame:
     cat = margins[margins["scope_type"] == "category"].set_index("scope_value")["margin_per_t"]
     prod = margins[margins["scope_type"] == "product"].set_index("scope_value")["margin_per_t"]
 
-    df["_margin"] = df["Product Category"].map(cat).fillna(0.0)
+    df["_margin"] = _scope_margin(df["Product Category"], cat).fillna(0.0)
 
-    prod_m = df["Product"].map(prod)
+    prod_m = _scope_margin(df["Product"], prod)
     df.loc[prod_m.notna(), "_margin"] = prod_m[prod_m.notna()]
 
     df["Sell Price"] = df["Price"].astype(float) + df["_margin"].astype(float)
     df = df.drop(columns=["_margin"], errors="ignore")
     return df
+
+
+def _scope_margin(col: pd.Series, by_value: pd.Series) -> pd.Series:
+    # Coded (compact) columns are looked up once per distinct value.
+    if is_coded(col):
+        return pd.Series(map_codes(col, by_value), index=col.index)
+    return col.map(by_value)
+
+
+class PricedFrameCache(SnapshotCache):
+    """
+    SnapshotCache of compact sell-price frames keyed by
+    (snapshot_id, margin_version).
+    """
+
+    def reprice_scope(self, scope_type: str, scope_value: str, margin_version: int, margins: pd.DataFrame):
+        """
+        Carry frames cached at margin_version - 1 forward to margin_version
+        after a change to a single margin. Only rows in that scope get their
+        Sell Price recomputed; every other column is shared with the old frame.
+        """
+        col = "Product" if scope_type == "product" else "Product Category"
+        with self._lock:
+            stale = [k for k in self._items if k[1] == margin_version - 1]
+            for key in stale:
+                df, size = self._items.pop(key)
+                self.nbytes -= size
+                df = _reprice_rows(df, df[col] == scope_value, margins)
+                self._store((key[0], margin_version), df, frame_nbytes(df))
+
+
+def _reprice_rows(df: pd.DataFrame, mask: pd.Series, margins: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy(deep=False)
+    if not mask.any():
+        return out
+    sell = out["Sell Price"].copy()
+    sell[mask] = apply_margins(out.loc[mask].drop(columns=["Sell Price"]), margins)["Sell Price"]
+    out["Sell Price"] = sell
+    return out
+
+
+PRICED_FRAMES = PricedFrameCache()
+
+
+def priced_prices(
+    snapshot_id: str,
+    margin_version: int,
+    load_prices: Callable[[str], pd.DataFrame]
+) -> pd.DataFrame:
+    """
+    Sell-price frame for a snapshot under the current margins, from
+    PRICED_FRAMES. load_prices must return the snapshot with "Sell Price"
+    already filled in (db keeps it materialised); it only runs on a miss,
+    i.e. for a new snapshot or after a margin change. Frames are cached in
+    compact form (see snapshot.compact_prices).
+    """
+    key = (snapshot_id, int(margin_version))
+    df = PRICED_FRAMES.get(key)
+    if df is not None:
+        return df
+
+    df = compact_prices(load_prices(snapshot_id))
+    PRICED_FRAMES.put(key, df)
+    return df.copy(deep=False)
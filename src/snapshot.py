@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Text columns of a price snapshot. A snapshot repeats a handful of distinct
+# suppliers, products, locations and windows over thousands of rows, so these
+# are held as pandas Categoricals: one int code per row plus a single copy of
+# each distinct string (categories are sorted, so code order is name order).
+TEXT_COLUMNS = ("Supplier", "Product Category", "Product", "Location", "Delivery Window", "Unit")
+PRICE_COLUMNS = ("Price", "Sell Price")
+
+# Default memory budget for cached snapshot frames (bytes).
+SNAPSHOT_CACHE_BYTES = 256 * 1024 * 1024
+
+# SnapshotCache hands out shallow copies of shared frames, which is only safe
+# under Copy-on-Write: always on from pandas 3, opt-in on pandas 2. Without it
+# an in-place edit (df.loc[...] = ...) on a copy would reach the cached frame.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def is_coded(series: pd.Series) -> bool:
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def compact_prices(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compact copy of a price frame: text columns dictionary-encoded (missing
+    text becomes ""), price columns float64. Other columns are kept as they are.
+    """
+    out = df.copy(deep=False)
+    for col in TEXT_COLUMNS:
+        if col in out.columns and not is_coded(out[col]):
+            out[col] = pd.Categorical(out[col].fillna("").astype(str))
+    for col in PRICE_COLUMNS:
+        if col in out.columns:
+            out[col] = out[col].astype(np.float64)
+    return out
+
+
+def lookup_codes(series: pd.Series, values) -> np.ndarray:
+    """
+    Codes of `values` in a coded column; values the column does not contain
+    get -2, which matches no row (-1 is pandas' code for a missing value).
+    """
+    codes = series.cat.categories.get_indexer(pd.Index(values, dtype=object))
+    codes[codes < 0] = -2
+    return codes
+
+
+def map_codes(series: pd.Series, mapping: pd.Series) -> np.ndarray:
+    """
+    mapping[value] for every row of a coded column, as float64 (NaN where the
+    value is not in mapping). The lookup runs once per distinct value.
+    """
+    per_code = mapping.reindex(series.cat.categories).to_numpy(dtype=np.float64)
+    codes = series.cat.codes.to_numpy()
+    out = np.full(len(codes), np.nan)
+    ok = codes >= 0
+    out[ok] = per_code[codes[ok]]
+    return out
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class SnapshotCache:
+    """
+    Process-wide LRU of snapshot frames with a memory budget rather than an
+    entry count: the least recently used frames are evicted until the total
+    (frame_nbytes) fits max_bytes. A frame larger than the whole budget is
+    not cached.
+
+    Published snapshots never change, so cached frames are shared by every
+    session and never modified in place. get() hands out shallow
+    copy-on-write copies (Copy-on-Write is enabled above): callers may edit
+    values, or add, drop or replace columns, without touching the cached
+    frame.
+    """
+
+    def __init__(self, max_bytes: int = SNAPSHOT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> pd.DataFrame | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        return item[0].copy(deep=False)
+
+    def put(self, key, df: pd.DataFrame):
+        size = frame_nbytes(df)
+        with self._lock:
+            self._store(key, df, size)
+
+    def _store(self, key, df: pd.DataFrame, size: int):
+        # Caller holds the lock.
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        if size > self.max_bytes:
+            return
+        self._items[key] = (df, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self.nbytes -= evicted
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -14,13 +14,13 @@ from src.db import (
 
     # Fertiliser snapshot functions (existing)
     latest_supplier_snapshot, list_supplier_snapshots,
-    load_supplier_prices, publish_supplier_snapshot,
+    load_supplier_prices, load_supplier_best_prices, publish_supplier_snapshot,
 
     # Seed snapshot functions (you will add in db.py later)
     latest_seed_snapshot, list_seed_snapshots,
-    load_seed_prices, publish_seed_snapshot,
+    load_seed_prices, load_seed_best_prices, publish_seed_snapshot,
 
-    add_margin, list_margins, deactivate_margin, get_effective_margins,
+    add_margin, list_margins, deactivate_margin, get_margin_version, get_effective_margins,
     create_order_from_allocation, list_orders_for_user, list_orders_admin,
     get_order_header, get_order_lines, get_order_actions,
     trader_cancel_order, trader_accept_counter,
@@ -30,11 +30,23 @@ from src.db import (
 )
 
 from src.validation import load_supplier_sheet, load_seed_sheet
-from src.optimizer import optimise_basket
-from src.pricing import apply_margins
+from src.optimizer import optimise_basket_cached, optimise_basket_split, TierSchedule
+from src.pricing import priced_prices, PRICED_FRAMES
+from src.snapshot import is_coded
 
 LOGO_PATH = "assets/logo.svg"
 
+# Search budget for "Optimise": return the best allocation found in this time
+# (with its optimality gap) rather than block the trader on a proof.
+OPTIMISE_TIME_LIMIT_SEC = 0.3
+
+# Runner-up allocations kept by the same optimiser pass (1 = best only).
+OPTIMISE_ALTERNATIVES = 3
+
+# Line-splitting mode: band search budget and default smallest piece (t).
+SPLIT_TIME_LIMIT_SEC = 1.0
+SPLIT_MIN_T_DEFAULT = 1.0
+
 import time
 import base64
 from pathlib import Path
@@ -143,6 +155,7 @@ BOOKS = {
         "latest_snapshot": latest_supplier_snapshot,
         "list_snapshots": list_supplier_snapshots,
         "load_prices": load_supplier_prices,
+        "load_best_prices": load_supplier_best_prices,
         "publish_snapshot": publish_supplier_snapshot,
         "loader": load_supplier_sheet,
         "upload_label": "Upload fertiliser prices (SUPPLIER_PRICES)",
@@ -153,6 +166,7 @@ BOOKS = {
         "latest_snapshot": latest_seed_snapshot,
         "list_snapshots": list_seed_snapshots,
         "load_prices": load_seed_prices,
+        "load_best_prices": load_seed_best_prices,
         "publish_snapshot": publish_seed_snapshot,
         "loader": load_seed_sheet,
         "upload_label": "Upload seed prices (SEED_PRICES)",
@@ -168,13 +182,17 @@ def _ss_key(book_code: str, name: str) -> str:
     return f"{book_code}__{name}"
 
 
-def _get_latest_prices_df_for(book_code: str):
+def _sell_prices_for(book_code: str, sid: str, margin_version: int) -> pd.DataFrame:
+    """Snapshot prices with Sell Price applied, from the priced-frame cache."""
+    return priced_prices(sid, margin_version, BOOKS_BY_CODE[book_code]["load_prices"])
+
+
+def _get_latest_sell_prices_for(book_code: str, margin_version: int):
     snap = BOOKS_BY_CODE[book_code]["latest_snapshot"]()
     if not snap:
         return None, None
     sid, ts, by = snap
-    df = BOOKS_BY_CODE[book_code]["load_prices"](sid)
-    return sid, df
+    return sid, _sell_prices_for(book_code, sid, margin_version)
 
 
 def _ensure_basket_for(book_code: str):
@@ -214,38 +232,6 @@ def render_header():
 
     st.divider()
 
-def _best_prices_board(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Returns best (lowest) SELL price per:
-      Product Category + Product + Location + Delivery Window
-
-    We ignore supplier in the grouping (we pick the cheapest supplier row per group).
-    Expects df to already include Sell Price (from apply_margins).
-    """
-    work = df.copy()
-
-    required = ["Product Category", "Product", "Location", "Delivery Window", "Supplier", "Sell Price", "Unit"]
-    for col in required:
-        if col not in work.columns:
-            raise ValueError(f"Missing column '{col}' needed for best price board.")
-
-    work["Product Category"] = work["Product Category"].fillna("").astype(str)
-    work["Product"] = work["Product"].fillna("").astype(str)
-    work["Location"] = work["Location"].fillna("").astype(str)
-    work["Delivery Window"] = work["Delivery Window"].fillna("").astype(str)
-    work["Supplier"] = work["Supplier"].fillna("").astype(str)
-    work["Unit"] = work["Unit"].fillna("").astype(str)
-    work["Sell Price"] = pd.to_numeric(work["Sell Price"], errors="raise")
-
-    group_cols = ["Product Category", "Product", "Location", "Delivery Window"]
-    idx = work.groupby(group_cols)["Sell Price"].idxmin()
-    best = work.loc[idx, group_cols + ["Sell Price", "Unit", "Supplier"]].copy()
-
-    best = best.rename(columns={"Sell Price": "Best Price"})
-    best = best.sort_values(["Product Category", "Product", "Location", "Delivery Window"]).reset_index(drop=True)
-    return best
-
-
 def page_trader_pricing():
     st.subheader("Trader | Pricing")
 
@@ -258,18 +244,15 @@ def page_trader_pricing():
         _page_trader_pricing_impl(book_code="seed")
 
 def _page_trader_pricing_impl(book_code: str):
-    sid, df = _get_latest_prices_df_for(book_code)
+    margin_version = get_margin_version()
+    sid, df = _get_latest_sell_prices_for(book_code, margin_version)
     if df is None:
         st.warning("No supplier snapshot available. Admin must publish one.")
         return
 
     settings = get_settings()
     timeout_min = int(settings.get("basket_timeout_minutes", "20"))
-    tiers = get_small_lot_tiers()
-
-    # Apply margins
-    margins = get_effective_margins()
-    df = apply_margins(df, margins)
+    tiers = TierSchedule.from_frame(get_small_lot_tiers())
 
     # Namespaced session keys
     basket_key = _ss_key(book_code, "basket")
@@ -337,6 +320,24 @@ def _page_trader_pricing_impl(book_code: str):
     st.markdown("### Basket")
     st.dataframe(bdf, use_container_width=True, hide_index=True)
 
+    s1, s2 = st.columns([1, 1])
+    with s1:
+        allow_split = st.checkbox(
+            "Allow line splitting",
+            value=False,
+            key=_ss_key(book_code, "allow_split"),
+            help="Let a line be divided between suppliers where that lowers the total."
+        )
+    with s2:
+        min_split = st.number_input(
+            "Min split (t)",
+            min_value=0.0,
+            value=SPLIT_MIN_T_DEFAULT,
+            step=0.5,
+            disabled=not allow_split,
+            key=_ss_key(book_code, "min_split")
+        )
+
     colA, colB = st.columns([1, 1])
     with colA:
         if st.button("Clear basket", use_container_width=True, key=_ss_key(book_code, "btn_clear_basket")):
@@ -350,11 +351,28 @@ def _page_trader_pricing_impl(book_code: str):
                 columns={"Sell Price": "Price"}
             )
 
-            res = optimise_basket(
-                supplier_prices=sell_prices,
-                basket=st.session_state[basket_key],
-                tiers=tiers
-            )
+            if allow_split:
+                res = optimise_basket_split(
+                    supplier_prices=sell_prices,
+                    basket=st.session_state[basket_key],
+                    tiers=tiers,
+                    min_split=float(min_split),
+                    time_limit=SPLIT_TIME_LIMIT_SEC,
+                    warm_start=st.session_state.get(last_optim_key)
+                )
+            else:
+                res = optimise_basket_cached(
+                    snapshot_id=sid,
+                    margins_version=str(margin_version),
+                    supplier_prices=sell_prices,
+                    basket=st.session_state[basket_key],
+                    tiers=tiers,
+                    time_limit=OPTIMISE_TIME_LIMIT_SEC,
+                    top_k=OPTIMISE_ALTERNATIVES,
+                    warm_start=st.session_state.get(last_optim_key),
+                    stats=True,
+                    engine="auto"
+                )
 
             if not res.get("ok"):
                 st.error(res.get("error", "Unknown error"))
@@ -381,10 +399,60 @@ def _page_trader_pricing_impl(book_code: str):
         st.dataframe(pd.DataFrame(res["lot_charges"]), use_container_width=True, hide_index=True)
 
     st.markdown("### Totals")
-    c1, c2, c3 = st.columns(3)
+    c1, c2, c3, c4 = st.columns(4)
     c1.metric("Base cost (sell)", f"£{float(res['base_cost']):,.2f}")
     c2.metric("Small-lot total", f"£{float(res['lot_charge_total']):,.2f}")
     c3.metric("Grand total", f"£{float(res['total']):,.2f}")
+    if res.get("optimal", res.get("complete", True)):
+        c4.metric("Optimality gap", "0.00%", help="Search finished: this allocation is proven optimal.")
+    else:
+        if res.get("split"):
+            stopped = "Split search (local optimum)."
+        elif res.get("engine") == "heuristic":
+            stopped = "Large supplier universe: heuristic search."
+        elif res.get("complete"):
+            stopped = "Search finished, but the lower bound is not tight enough to prove optimality."
+        else:
+            stopped = "Search stopped at the time limit."
+        c4.metric(
+            "Optimality gap",
+            f"{float(res['gap_pct']):.2f}%",
+            help=f"{stopped} No allocation can cost less than "
+                 f"£{float(res['lower_bound']):,.2f} (at most £{float(res['gap']):,.2f} above optimal)."
+        )
+
+    top_ups = res.get("top_ups") or []
+    if top_ups:
+        st.markdown("### Tier top-ups")
+        for t in top_ups:
+            st.caption(
+                f"Add {float(t['Add t']):,.2f} t of {t['Product']} ({t['Location']}, {t['Delivery Window']}) "
+                f"from {t['Supplier']} to reach {float(t['New Tonnes']):,.2f} t and save £{float(t['Saving']):,.2f}"
+            )
+
+    if res.get("stats"):
+        with st.expander("Search stats"):
+            st.json(res["stats"])
+
+    alternatives = res.get("alternatives") or []
+    if alternatives:
+        st.markdown("### Alternatives")
+        alt_df = pd.DataFrame([
+            {
+                "Rank": alt["rank"],
+                "Suppliers": ", ".join(alt["suppliers"]),
+                "Grand total": alt["total"],
+                "vs best": alt["delta"],
+            }
+            for alt in alternatives
+        ])
+        st.dataframe(alt_df, use_container_width=True, hide_index=True)
+
+        for alt in alternatives:
+            with st.expander(f"Alternative {alt['rank']} (+£{float(alt['delta']):,.2f})"):
+                st.dataframe(pd.DataFrame(alt["allocation"]), use_container_width=True, hide_index=True)
+                if alt.get("lot_charges"):
+                    st.dataframe(pd.DataFrame(alt["lot_charges"]), use_container_width=True, hide_index=True)
 
     st.divider()
     st.markdown("### Checkout")
@@ -551,6 +619,13 @@ def page_admin_pricing():
 
     st.subheader("Admin | Pricing")
 
+    with st.expander("Snapshot cache"):
+        cs = PRICED_FRAMES.stats()
+        st.caption(
+            f"{cs['entries']} snapshot(s) | {cs['bytes'] / 2**20:,.1f} of {cs['max_bytes'] / 2**20:,.0f} MB | "
+            f"hits {cs['hits']} | misses {cs['misses']} ({cs['hit_rate']:.0%} hit rate) | evictions {cs['evictions']}"
+        )
+
     tab_f, tab_s = st.tabs(["Fertiliser", "Seed"])
     with tab_f:
         _page_admin_pricing_impl(book_code="fert")
@@ -623,9 +698,13 @@ def _page_admin_pricing_impl(book_code: str):
             if mid <= 0:
                 st.error("Enter a valid margin_id.")
             else:
-                deactivate_margin(int(mid))
-                st.success(f"Deactivated margin_id={int(mid)}")
-                st.rerun()
+                change = deactivate_margin(int(mid))
+                if change is None:
+                    st.error(f"margin_id={int(mid)} is not an active margin.")
+                else:
+                    PRICED_FRAMES.reprice_scope(*change, get_effective_margins())
+                    st.success(f"Deactivated margin_id={int(mid)}")
+                    st.rerun()
 
     st.markdown("#### Add new margin")
     scope_type = st.selectbox("Scope", ["category", "product"], key=_ss_key(book_code, "margin_scope_type"))
@@ -633,7 +712,8 @@ def _page_admin_pricing_impl(book_code: str):
     margin_per_t = st.number_input("Margin (£/t)", value=0.0, step=0.5, key=_ss_key(book_code, "margin_per_t"))
     if st.button("Add margin", type="primary", use_container_width=True, key=_ss_key(book_code, "btn_add_margin")):
         try:
-            add_margin(scope_type, scope_value, float(margin_per_t), st.session_state.get("user", "unknown"))
+            change = add_margin(scope_type, scope_value, float(margin_per_t), st.session_state.get("user", "unknown"))
+            PRICED_FRAMES.reprice_scope(*change, get_effective_margins())
             st.success("Margin added.")
             st.rerun()
         except Exception as e:
@@ -826,6 +906,21 @@ def page_history():
     with tab_s:
         _page_history_impl(book_code="seed")
 
+def _search_mask(df: pd.DataFrame, q: str) -> pd.Series:
+    """Rows where any column contains q (case-insensitive)."""
+    ql = q.lower()
+    mask = pd.Series(False, index=df.index)
+    for col in df.columns:
+        s = df[col]
+        if is_coded(s):
+            # Test each distinct value once, then select rows by code.
+            hits = s.cat.categories.astype(str).str.lower().str.contains(ql, regex=False)
+            mask |= s.isin(s.cat.categories[hits])
+        else:
+            mask |= s.astype(str).str.lower().str.contains(ql, regex=False)
+    return mask
+
+
 def _page_history_impl(book_code: str):
     snaps = BOOKS_BY_CODE[book_code]["list_snapshots"]()
     if snaps.empty:
@@ -837,17 +932,13 @@ def _page_history_impl(book_code: str):
     label = st.selectbox("Select snapshot", snaps["label"].tolist(), key=_ss_key(book_code, "hist_select"))
     sid = snaps.loc[snaps["label"] == label, "snapshot_id"].iloc[0]
 
-    df = BOOKS_BY_CODE[book_code]["load_prices"](sid)
-
-    margins = get_effective_margins()
-    df = apply_margins(df, margins)
+    df = _sell_prices_for(book_code, sid, get_margin_version())
     df["Price"] = df["Sell Price"]
     df = df.drop(columns=["Sell Price"], errors="ignore")
 
     q = st.text_input("Search", key=_ss_key(book_code, "hist_search"))
     if q:
-        ql = q.lower()
-        df = df[df.apply(lambda r: any(ql in str(v).lower() for v in r.values), axis=1)]
+        df = df[_search_mask(df, q)]
 
     st.dataframe(df, use_container_width=True, hide_index=True)
 
@@ -861,15 +952,14 @@ def page_trader_best_prices():
         _page_trader_best_prices_impl(book_code="seed")
 
 def _page_trader_best_prices_impl(book_code: str):
-    sid, df = _get_latest_prices_df_for(book_code)
-    if df is None:
+    snap = BOOKS_BY_CODE[book_code]["latest_snapshot"]()
+    if not snap:
         st.warning("No supplier snapshot available. Admin must publish one.")
         return
+    sid = snap[0]
 
-    margins = get_effective_margins()
-    df = apply_margins(df, margins)
-
-    board = _best_prices_board(df)
+    # Precomputed in the db per (snapshot, margin version)
+    board = BOOKS_BY_CODE[book_code]["load_best_prices"](sid)
 
     st.markdown("### Filters")
     f1, f2, f3, f4 = st.columns([2, 2, 2, 2])
@@ -0,0 +1,271 @@
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from src import db
+from src.pricing import PricedFrameCache, apply_margins
+from src.snapshot import compact_prices
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "foresight.db"))
+    db.init_db()
+    return db
+
+
+def _snapshot():
+    rows = []
+    for supplier, bump in (("Alpha", 0.0), ("Beta", 4.0), ("Gamma", -3.0)):
+        for category, product, price in (
+            ("Nitrogen", "AN", 300.0),
+            ("Nitrogen", "Urea", 280.0),
+            ("Phosphate", "DAP", 450.0),
+            ("", "Lime", 40.0),
+        ):
+            for location, window in (("North", "Mar"), ("South", "Apr")):
+                rows.append({
+                    "Supplier": supplier,
+                    "Product Category": category,
+                    "Product": product,
+                    "Location": location,
+                    "Delivery Window": window,
+                    "Price": price + bump + (5.0 if location == "South" else 0.0),
+                    "Unit": "t",
+                })
+    return pd.DataFrame(rows)
+
+
+def _expected(prices: pd.DataFrame) -> pd.DataFrame:
+    return apply_margins(prices.drop(columns=["Sell Price"]), db.get_effective_margins())
+
+
+def _check_sell_prices(load_prices, load_board, snapshot_id):
+    prices = load_prices(snapshot_id)
+    expected = _expected(prices)
+    assert prices["Sell Price"].tolist() == pytest.approx(expected["Sell Price"].tolist())
+
+    keys = ["Product Category", "Product", "Location", "Delivery Window"]
+    board = (
+        expected.sort_values(keys + ["Sell Price", "Supplier"])
+        .drop_duplicates(subset=keys)
+        .sort_values(keys)
+        .reset_index(drop=True)
+    )
+    got = load_board(snapshot_id)
+    assert got[keys + ["Supplier"]].values.tolist() == board[keys + ["Supplier"]].values.tolist()
+    assert got["Best Price"].tolist() == pytest.approx(board["Sell Price"].tolist())
+
+
+def test_materialised_sell_prices_match_apply_margins(fresh_db):
+    supplier_id = db.publish_supplier_snapshot(_snapshot(), "admin", b"supplier")
+    seed_id = db.publish_seed_snapshot(_snapshot(), "admin", b"seed")
+    checks = [
+        (db.load_supplier_prices, db.load_supplier_best_prices, supplier_id),
+        (db.load_seed_prices, db.load_seed_best_prices, seed_id),
+    ]
+
+    def check_all():
+        for load_prices, load_board, snapshot_id in checks:
+            _check_sell_prices(load_prices, load_board, snapshot_id)
+
+    check_all()
+
+    db.add_margin("category", "Nitrogen", 12.0, "admin")
+    check_all()
+
+    # A product margin beats its category's; the newest margin per scope wins.
+    db.add_margin("product", "Urea", 30.0, "admin")
+    db.add_margin("category", "Nitrogen", 15.0, "admin")
+    db.add_margin("product", "Lime", -45.0, "admin")
+    db.add_margin("product", "Urea", 22.0, "admin")
+    check_all()
+
+    margins = db.list_margins()
+    newest_urea = margins[margins["scope_value"] == "Urea"]["margin_id"].iloc[0]
+    db.deactivate_margin(int(newest_urea))
+    check_all()
+
+    newest_nitrogen = margins[margins["scope_value"] == "Nitrogen"]["margin_id"].iloc[0]
+    db.deactivate_margin(int(newest_nitrogen))
+    check_all()
+
+    # The latest snapshot's board is rebuilt eagerly, older ones when read.
+    older = supplier_id
+    newer = db.publish_supplier_snapshot(_snapshot(), "admin", b"supplier 2")
+    db.add_margin("category", "Phosphate", 20.0, "admin")
+    _check_sell_prices(db.load_supplier_prices, db.load_supplier_best_prices, newer)
+    _check_sell_prices(db.load_supplier_prices, db.load_supplier_best_prices, older)
+
+
+def test_reprice_scope_matches_fresh_load(fresh_db):
+    supplier_id = db.publish_supplier_snapshot(_snapshot(), "admin", b"supplier")
+    cache = PricedFrameCache()
+
+    def fresh():
+        return compact_prices(db.load_supplier_prices(supplier_id))
+
+    def deactivate(scope_value):
+        margins = db.list_margins()
+        return db.deactivate_margin(int(margins[margins["scope_value"] == scope_value]["margin_id"].iloc[0]))
+
+    cache.put((supplier_id, db.get_margin_version()), fresh())
+    for step in (
+        lambda: db.add_margin("category", "Nitrogen", 12.0, "admin"),
+        lambda: db.add_margin("product", "Urea", 30.0, "admin"),
+        lambda: db.add_margin("product", "Lime", -45.0, "admin"),
+        lambda: deactivate("Urea"),
+        lambda: deactivate("Nitrogen"),
+    ):
+        change = step()
+        cache.reprice_scope(*change, db.get_effective_margins())
+        carried = cache.get((supplier_id, change[2]))
+        assert carried is not None
+        pd.testing.assert_frame_equal(carried, fresh())
+
+
+def test_pool_waits_when_every_connection_is_in_use(fresh_db):
+    pool = db._ConnectionPool(2)
+    release = threading.Event()
+    entered = []
+    conns = []
+
+    def work(name):
+        with pool.transaction() as c:
+            entered.append(name)
+            conns.append(c)
+            release.wait(5)
+
+    first = [threading.Thread(target=work, args=(n,)) for n in ("a", "b")]
+    for t in first:
+        t.start()
+    while len(entered) < 2:
+        time.sleep(0.01)
+
+    late = threading.Thread(target=work, args=("c",))
+    late.start()
+    time.sleep(0.2)
+    assert sorted(entered) == ["a", "b"]
+
+    release.set()
+    for t in first + [late]:
+        t.join(5)
+    assert sorted(entered) == ["a", "b", "c"]
+    assert len({id(c) for c in conns}) == 2
+    pool.close()
+
+
+def test_nested_transactions_share_one_connection(fresh_db):
+    with db.transaction() as outer:
+        with db.transaction() as inner:
+            assert inner is outer
+        assert db._POOL.held().conn is outer
+    assert db._POOL.held() is None
+
+
+def test_transaction_rolls_back_when_the_block_raises(fresh_db):
+    with db.transaction() as c:
+        c.execute("CREATE TABLE scratch (x INTEGER)")
+
+    with pytest.raises(RuntimeError):
+        with db.transaction() as c:
+            c.execute("INSERT INTO scratch VALUES (1)")
+            with db.transaction() as inner:
+                inner.execute("INSERT INTO scratch VALUES (2)")
+            raise RuntimeError("boom")
+
+    with db.transaction() as c:
+        assert c.execute("SELECT COUNT(*) FROM scratch").fetchone()[0] == 0
+        c.execute("INSERT INTO scratch VALUES (3)")
+    with db.transaction() as c:
+        assert c.execute("SELECT x FROM scratch").fetchall() == [(3,)]
+
+
+def test_data_versions_sees_commits_from_other_connections(fresh_db):
+    before = db.data_versions()
+
+    other = sqlite3.connect(db.DB_PATH)
+    other.execute("UPDATE data_versions SET version = version + 1 WHERE domain = 'margins'")
+    other.commit()
+    other.close()
+
+    after = db.data_versions()
+    assert after["margins"] == before["margins"] + 1
+    assert {d: v for d, v in after.items() if d != "margins"} == {
+        d: v for d, v in before.items() if d != "margins"
+    }
+
+
+def test_data_versions_skips_the_query_while_nothing_changed(fresh_db):
+    statements = []
+    with db.transaction() as c:
+        c.set_trace_callback(statements.append)
+    try:
+        db.data_versions()
+        statements.clear()
+        db.data_versions()
+        assert not any("FROM data_versions" in s for s in statements)
+        assert any("data_version" in s for s in statements)
+
+        db.set_setting("theme", "dark")
+        statements.clear()
+        db.data_versions()
+        assert any("FROM data_versions" in s for s in statements)
+    finally:
+        with db.transaction() as c:
+            c.set_trace_callback(None)
+
+
+def _baseline_db(path):
+    """A database as init_db left it before schema_version existed (migration 1 only)."""
+    c = sqlite3.connect(path)
+    cur = c.cursor()
+    db._migrate_001_initial(cur)
+    cur.execute("""
+        INSERT INTO supplier_snapshots (snapshot_id, published_at_utc, published_by, source_hash, row_count)
+        VALUES ('old', '2024-01-01T00:00:00+00:00', 'admin', 'x', 2)
+    """)
+    cur.executemany("""
+        INSERT INTO supplier_prices
+        (snapshot_id, supplier, product_category, product, location, delivery_window, price, unit)
+        VALUES ('old', ?, 'Nitrogen', 'AN', 'North', 'Mar', ?, 't')
+    """, [("Alpha", 300.0), ("Beta", 296.0)])
+    cur.execute("""
+        INSERT INTO price_margins (scope_type, scope_value, margin_per_t, active, created_at_utc, created_by)
+        VALUES ('category', 'Nitrogen', 12.0, 1, '2024-01-01T00:00:00+00:00', 'admin')
+    """)
+    c.commit()
+    c.close()
+
+
+def test_init_db_migrates_a_baseline_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "baseline.db")
+    _baseline_db(path)
+    monkeypatch.setattr(db, "DB_PATH", path)
+
+    db.init_db()
+
+    with db.transaction() as c:
+        versions = [r[0] for r in c.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [v for v, _ in db.MIGRATIONS] and versions[-1] == db.SCHEMA_VERSION
+    assert set(db.data_versions()) == set(db.DOMAINS)
+
+    prices = db.load_supplier_prices("old")
+    assert prices["Sell Price"].tolist() == pytest.approx([312.0, 308.0])
+    board = db.load_supplier_best_prices("old")
+    assert board["Supplier"].tolist() == ["Beta"]
+    assert board["Best Price"].tolist() == pytest.approx([308.0])
+
+
+def test_second_init_db_writes_nothing(fresh_db):
+    observer = sqlite3.connect(db.DB_PATH)
+    before = observer.execute("PRAGMA data_version").fetchone()[0]
+
+    db._SCHEMA_READY.discard(db.DB_PATH)
+    db.init_db()
+
+    assert observer.execute("PRAGMA data_version").fetchone()[0] == before
+    observer.close()
@@ -0,0 +1,350 @@
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import optimizer
+
+from src.optimizer import (
+    RESULT_CACHE,
+    PriceIndex,
+    TierSchedule,
+    optimise_basket,
+    optimise_basket_cached,
+    optimise_basket_split,
+    optimise_baskets,
+)
+from src.snapshot import compact_prices
+
+# The seeded small-lot tiers (src/db.py), including the 4.80-4.90 gap and the
+# shared 24 t boundary.
+DEFAULT_TIERS = [
+    (0.60, 2.39, 130.0),
+    (2.40, 4.80, 70.0),
+    (4.90, 9.90, 15.0),
+    (10.0, 14.9, 8.0),
+    (15.0, 24.0, 4.0),
+    (24.0, None, 0.0),
+]
+
+
+def _tiers(rows):
+    return pd.DataFrame(
+        [(mn, mx, cpt, 1) for mn, mx, cpt in rows],
+        columns=["min_t", "max_t", "charge_per_t", "active"]
+    )
+
+
+def _prices(rows):
+    return pd.DataFrame(
+        [
+            {"Supplier": s, "Product": p, "Location": "L", "Delivery Window": "W", "Price": float(price)}
+            for s, p, price in rows
+        ]
+    )
+
+
+def _basket(rows):
+    return [{"Product": p, "Location": "L", "Delivery Window": "W", "Qty": float(q)} for p, q in rows]
+
+
+def _reference_charge_per_t(tonnes: float, tiers: pd.DataFrame) -> float:
+    """The tier lookup optimise_basket used before TierSchedule, row by row."""
+    t = float(tonnes)
+    if t <= 0:
+        return 0.0
+    active = tiers[tiers["active"].astype(int) == 1].sort_values("min_t")
+    for r in active.to_dict("records"):
+        mn = float(r["min_t"])
+        mx = r.get("max_t", None)
+        mx = None if mx is None or (isinstance(mx, float) and pd.isna(mx)) else float(mx)
+        if (t + 1e-9) >= mn and (mx is None or (t - 1e-9) <= mx):
+            return float(r["charge_per_t"])
+    return 0.0
+
+
+def _brute_force(prices: pd.DataFrame, basket: list[dict], tiers: pd.DataFrame) -> list[float]:
+    """
+    Totals of every no-split allocation (each line to any supplier quoting
+    it, all combinations), cheapest first.
+    """
+    quotes = {}
+    for r in prices.to_dict("records"):
+        quotes.setdefault(r["Product"], []).append((r["Price"], r["Supplier"]))
+
+    totals = []
+    for choice in product(*(quotes[line["Product"]] for line in basket)):
+        tonnes = {}
+        for line, (_, s) in zip(basket, choice):
+            tonnes[s] = tonnes.get(s, 0.0) + line["Qty"]
+        total = sum(line["Qty"] * p for line, (p, _) in zip(basket, choice))
+        total += sum(t * _reference_charge_per_t(t, tiers) for t in tonnes.values())
+        totals.append(total)
+    return sorted(totals)
+
+
+def _instance(seed: int):
+    """Small random basket: 1-5 lines, 2-7 suppliers quoting ~70% of lines."""
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 6))
+    k = int(rng.integers(2, 8))
+    products = [f"P{i}" for i in range(n)]
+    suppliers = [f"S{j}" for j in range(k)]
+
+    rows = []
+    for i, p in enumerate(products):
+        quoting = [s for s in suppliers if rng.random() < 0.7] or [suppliers[i % k]]
+        rows.extend((s, p, int(rng.integers(90, 131))) for s in quoting)
+
+    qtys = rng.choice([0.5, 1.0, 2.4, 3.0, 4.8, 4.85, 5.0, 9.9, 12.0, 24.0], size=n)
+    return _prices(rows), _basket(zip(products, qtys))
+
+
+SEEDS = range(40)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_matches_brute_force(seed):
+    prices, basket = _instance(seed)
+    tiers = _tiers(DEFAULT_TIERS)
+    expected = _brute_force(prices, basket, tiers)[0]
+
+    for sp in (prices, compact_prices(prices), PriceIndex(prices)):
+        res = optimise_basket(sp, basket, TierSchedule.from_frame(tiers))
+        assert res["ok"] and res["complete"]
+        assert res["total"] == pytest.approx(expected)
+        assert res["total"] == pytest.approx(res["base_cost"] + res["lot_charge_total"])
+        assert res["lower_bound"] <= expected + 1e-6
+        assert res["optimal"] == (res["gap"] <= 1e-9)
+
+
+def test_polish_beats_cheapest_in_set():
+    # a and b are in every covering set, so A always goes to a; moving it to
+    # b (dearer) lifts b into the 5 t tier, which saves more than it costs.
+    tiers = _tiers([(0.0, 4.99, 40.0), (5.0, None, 0.0)])
+    prices = _prices([("a", "A", 100), ("a", "C", 100), ("b", "A", 101), ("b", "B", 100)])
+    basket = _basket([("A", 2), ("B", 4), ("C", 5)])
+
+    res = optimise_basket(prices, basket, tiers)
+    assert res["total"] == pytest.approx(_brute_force(prices, basket, tiers)[0]) == 1102.0
+    assert [a["Supplier"] for a in res["allocation"]] == ["b", "b", "a"]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_top_k_matches_brute_force(seed):
+    prices, basket = _instance(seed)
+    tiers = _tiers(DEFAULT_TIERS)
+    every = _brute_force(prices, basket, tiers)
+
+    res = optimise_basket(prices, basket, tiers, top_k=3)
+    totals = [res["total"]] + [alt["total"] for alt in res["alternatives"]]
+    assert totals == sorted(totals)
+    assert res["total"] == pytest.approx(every[0])
+    assert len({tuple(a["Supplier"] for a in alt["allocation"]) for alt in [res] + res["alternatives"]}) == len(totals)
+    for t in totals:
+        assert min(abs(t - x) for x in every) < 1e-6
+
+
+@pytest.mark.parametrize("seed", SEEDS[:5])
+def test_parallel_matches_serial(seed):
+    prices, basket = _instance(seed)
+    tiers = TierSchedule.from_frame(_tiers(DEFAULT_TIERS))
+
+    serial = optimise_basket(prices, basket, tiers)
+    parallel = optimise_basket(prices, basket, tiers, workers=2)
+    assert parallel["complete"]
+    assert parallel["total"] == pytest.approx(serial["total"])
+    assert parallel["allocation"] == serial["allocation"]
+
+
+def test_tier_schedule_matches_reference_at_boundaries():
+    tiers = _tiers(DEFAULT_TIERS)
+    schedule = TierSchedule.from_frame(tiers)
+
+    points = [0.0, -1.0, 0.3, 100.0]
+    for mn, mx, _ in DEFAULT_TIERS:
+        for edge in (mn, mx):
+            if edge is not None:
+                points.extend([edge - 1e-6, edge - 1e-9, edge, edge + 1e-9, edge + 1e-6])
+
+    expected = [_reference_charge_per_t(t, tiers) for t in points]
+    assert [schedule.charge_per_t(t) for t in points] == expected
+    assert schedule.charges(np.array(points)).tolist() == expected
+
+
+def test_dominance_keeps_supplier_whose_rival_drags_others_into_dearer_tiers():
+    # b undercuts a on A by more than any single supplier's worst charge, but
+    # taking b also pulls V1/V2 off c1/c2 and drops both into the dear tier.
+    tiers = _tiers([(0.0, 4.99, 80.0), (5.0, 24.99, 10.0), (25.0, None, 0.0)])
+    prices = _prices([
+        ("a", "A", 117), ("b", "A", 100),
+        ("c1", "U1", 100), ("c1", "V1", 100), ("b", "V1", 99.99),
+        ("c2", "U2", 100), ("c2", "V2", 100), ("b", "V2", 99.99),
+    ])
+    basket = _basket([("A", 24), ("U1", 4.8), ("V1", 0.2), ("U2", 4.8), ("V2", 0.2)])
+
+    res = optimise_basket(prices, basket, tiers)
+    assert res["total"] == pytest.approx(_brute_force(prices, basket, tiers)[0]) == 3740.0
+    assert sorted({a["Supplier"] for a in res["allocation"]}) == ["b", "c1", "c2"]
+    assert optimise_basket(prices, basket, tiers, top_k=2)["total"] == res["total"]
+
+
+def test_dominance_prunes_supplier_undercut_on_every_line():
+    # b quotes everything a does, £5/t cheaper: more than merging a's 10 t
+    # onto b can ever add in small-lot charges (£38.80 at worst, with b
+    # parked in the 4.80-4.90 gap), so a is dropped before the search.
+    tiers = _tiers(DEFAULT_TIERS)
+    prices = _prices([("a", "A", 105), ("b", "A", 100), ("b", "B", 100), ("c", "B", 99)])
+    basket = _basket([("A", 10), ("B", 6)])
+
+    for top_k in (1, 3):
+        res = optimise_basket(prices, basket, tiers, top_k=top_k)
+        assert res["pruned_suppliers"] == 1
+        assert res["total"] == pytest.approx(_brute_force(prices, basket, tiers)[0])
+        for alt in [res] + res["alternatives"]:
+            assert "a" not in {a["Supplier"] for a in alt["allocation"]}
+
+    # At £3/t cheaper the saving no longer covers the worst case, so a stays.
+    prices.loc[prices["Supplier"] == "a", "Price"] = 103.0
+    assert optimise_basket(prices, basket, tiers)["pruned_suppliers"] == 0
+
+
+def test_warm_start_visits_fewer_nodes_after_adding_a_line():
+    rng = np.random.default_rng(7)
+    suppliers = [f"S{j:02d}" for j in range(14)]
+    rows = []
+    for i in range(9):
+        ref = rng.uniform(180.0, 420.0)
+        quoting = [s for s in suppliers if rng.random() < 0.7]
+        rows.extend((s, f"P{i}", round(ref * rng.uniform(0.9, 1.1))) for s in quoting)
+    prices = _prices(rows)
+    basket = _basket((f"P{i}", q) for i, q in enumerate(rng.choice([1.0, 2.4, 4.8, 9.9, 12.0], size=9)))
+    tiers = TierSchedule.from_frame(_tiers(DEFAULT_TIERS))
+
+    previous = optimise_basket(prices, basket[:-1], tiers)
+    cold = optimise_basket(prices, basket, tiers)
+    warm = optimise_basket(prices, basket, tiers, warm_start=previous)
+    assert warm["complete"] and cold["complete"]
+    assert warm["total"] == pytest.approx(cold["total"])
+    assert warm["nodes"] < cold["nodes"]
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_optimise_baskets_matches_each_basket_in_order(workers):
+    prices = pd.concat([_instance(seed)[0] for seed in range(6)]).drop_duplicates(["Supplier", "Product"])
+    baskets = [_instance(seed)[1] for seed in range(6)]
+    tiers = _tiers(DEFAULT_TIERS)
+
+    expected = [optimise_basket(prices, basket, tiers)["total"] for basket in baskets]
+    results = list(optimise_baskets(prices, baskets, tiers, workers=workers))
+    assert [res["total"] for res in results] == pytest.approx(expected)
+    assert [[a["Product"] for a in res["allocation"]] for res in results] == [
+        [line["Product"] for line in basket] for basket in baskets
+    ]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_heuristic_bounds_brute_force(seed):
+    prices, basket = _instance(seed)
+    tiers = _tiers(DEFAULT_TIERS)
+    expected = _brute_force(prices, basket, tiers)[0]
+
+    res = optimise_basket(prices, basket, tiers, engine="heuristic")
+    assert res["engine"] == "heuristic" and res["complete"]
+    assert res["total"] >= expected - 1e-6
+    assert res["lower_bound"] <= expected + 1e-6
+    if res["optimal"]:
+        assert res["total"] == pytest.approx(expected)
+
+
+def test_heuristic_incomplete_when_out_of_time():
+    prices, basket = _instance(2)
+    tiers = _tiers(DEFAULT_TIERS)
+
+    res = optimise_basket(prices, basket, tiers, engine="heuristic", time_limit=0.0)
+    assert res["ok"] and not res["complete"]
+    assert res["lower_bound"] <= res["total"]
+
+
+def test_auto_engine_switches_above_threshold(monkeypatch):
+    prices, basket = _instance(2)
+    tiers = _tiers(DEFAULT_TIERS)
+    res = optimise_basket(prices, basket, tiers, engine="auto")
+    kept = prices["Supplier"].nunique() - res["pruned_suppliers"]
+    assert res["engine"] == "exact"
+
+    monkeypatch.setattr(optimizer, "HEURISTIC_SUPPLIERS", kept - 1)
+    assert optimise_basket(prices, basket, tiers, engine="auto")["engine"] == "heuristic"
+    monkeypatch.setattr(optimizer, "HEURISTIC_SUPPLIERS", kept)
+    assert optimise_basket(prices, basket, tiers, engine="auto")["engine"] == "exact"
+
+
+def test_top_ups_for_suppliers_just_under_a_tier():
+    # a carries 4.7 t (£70/t, £329), 0.2 t short of the £15/t tier:
+    # topping up to 4.9 t costs 0.2 x £10 + 4.9 x £15 = £75.50, saving £253.50.
+    # b carries 2.3 t (£130/t, £299), 0.1 t short of the £70/t tier.
+    tiers = _tiers(DEFAULT_TIERS)
+    prices = _prices([("a", "A", 10), ("b", "B", 20)])
+    basket = _basket([("A", 4.7), ("B", 2.3)])
+
+    top_ups = optimise_basket(prices, basket, tiers)["top_ups"]
+    got = [(t["Supplier"], t["Product"], t["Add t"], t["New Tonnes"], t["Saving"]) for t in top_ups]
+    assert got == [
+        ("a", "A", pytest.approx(0.2), 4.9, pytest.approx(253.5)),
+        ("a", "A", pytest.approx(5.3), 10.0, pytest.approx(196.0)),
+        ("b", "B", pytest.approx(2.6), 4.9, pytest.approx(173.5)),
+        ("a", "A", pytest.approx(10.3), 15.0, pytest.approx(166.0)),
+        ("b", "B", pytest.approx(0.1), 2.4, pytest.approx(129.0)),
+    ]
+    assert top_ups[0]["Charge £/t"] == 70.0 and top_ups[0]["New Charge £/t"] == 15.0
+
+
+def test_cache_skips_budget_limited_results():
+    prices, basket = _instance(3)
+    tiers = _tiers(DEFAULT_TIERS)
+    RESULT_CACHE.clear()
+
+    first = optimise_basket_cached("snap", "m1", prices, basket, tiers, node_limit=1)
+    assert not first["complete"]
+    assert RESULT_CACHE.stats()["entries"] == 0
+
+    second = optimise_basket_cached("snap", "m1", prices, basket, tiers, warm_start=first)
+    assert second is not first and second["complete"]
+    assert second["total"] == pytest.approx(_brute_force(prices, basket, tiers)[0])
+    assert optimise_basket_cached("snap", "m1", prices, basket, tiers, node_limit=1) is second
+    RESULT_CACHE.clear()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("min_split", [0.0, 1.0])
+def test_split_never_dearer_than_no_split(seed, min_split):
+    prices, basket = _instance(seed)
+    tiers = _tiers(DEFAULT_TIERS)
+    # Split mode seeds from the heuristic engine's local search.
+    expected = optimise_basket(prices, basket, tiers, engine="heuristic")["total"]
+
+    res = optimise_basket_split(prices, basket, tiers, min_split=min_split)
+    assert res["ok"] and res["complete"]
+    assert res["total"] <= expected + 1e-6
+    assert res["total"] == pytest.approx(res["base_cost"] + res["lot_charge_total"])
+    for line in basket:
+        pieces = [a for a in res["allocation"] if a["Product"] == line["Product"]]
+        assert sum(a["Qty"] for a in pieces) == pytest.approx(line["Qty"])
+        if len(pieces) > 1:
+            assert min(a["Qty"] for a in pieces) >= min_split - 1e-9
+
+
+def test_split_handles_negative_prices():
+    # MinCostFlow rejects negative arc costs; split mode must still solve.
+    tiers = _tiers(DEFAULT_TIERS)
+    prices = _prices([("A", "X", -5), ("B", "X", -4), ("B", "Y", -20), ("A", "Y", 3)])
+    basket = _basket([("X", 3), ("Y", 1.5)])
+
+    no_split = optimise_basket(prices, basket, tiers)
+    assert no_split["total"] == pytest.approx(_brute_force(prices, basket, tiers)[0])
+
+    res = optimise_basket_split(prices, basket, tiers)
+    assert res["ok"]
+    assert res["total"] <= no_split["total"] + 1e-6
+    assert res["total"] == pytest.approx(res["base_cost"] + res["lot_charge_total"])
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from src.snapshot import SnapshotCache, compact_prices
+
+
+def _frame():
+    return compact_prices(pd.DataFrame({
+        "Supplier": ["Alpha", "Beta"],
+        "Product": ["AN", "AN"],
+        "Price": [300.0, 310.0],
+        "Sell Price": [312.0, 322.0],
+    }))
+
+
+def test_in_place_edits_do_not_reach_the_cached_frame():
+    cache = SnapshotCache()
+    cache.put("snap", _frame())
+
+    df = cache.get("snap")
+    df.loc[df["Supplier"] == "Alpha", "Sell Price"] = 0.0
+    df.iloc[1, df.columns.get_loc("Price")] = -1.0
+    df["Product"] = df["Product"].cat.rename_categories({"AN": "Urea"})
+
+    again = cache.get("snap")
+    assert again["Sell Price"].tolist() == [312.0, 322.0]
+    assert again["Price"].tolist() == [300.0, 310.0]
+    assert again["Product"].tolist() == ["AN", "AN"]